@@ -0,0 +1,57 @@
+from __future__ import print_function
+import argparse
+import time
+import numpy as np
+
+from drivers.ADS1115 import ADS1115, RATES
+from drivers.FakeSMBus import FakeSMBus
+
+#Benchmarks sampling with the ADS1115 driver, without a device (see drivers/FakeSMBus.py).
+#
+# Compares taking N readings one at a time in single-shot mode (a config write, a sleep
+# and a read per reading, as power_monitor.py used to) with read_burst (continuous mode,
+# one read per reading), reporting the samples/sec achieved, the jitter in the time between
+# samples and the number of i2c transactions, e.g.
+#
+#    python -m benchmarks.ads1115 --n 500 --latency 0.0003
+
+
+#takes n readings one at a time with read(), in single-shot mode
+def single_shot(adc, n):
+    adc.set_mode(1)
+    t = np.zeros(n)
+    v = np.zeros(n)
+    t0 = time.perf_counter()
+    for i in range(n):
+        v[i] = adc.read()
+        t[i] = time.perf_counter() - t0
+    return t, v
+
+def burst(adc, n):
+    return adc.read_burst(n)
+
+
+def report(name, t, transactions):
+    dt = np.diff(t)*1000
+    print("%-12s %7.1f samples/sec | dt mean %.3f ms, std %.3f ms, max %.3f ms | %d transactions"%(
+        name, (len(t) - 1)/(t[-1] - t[0]), np.mean(dt), np.std(dt), np.max(dt), transactions))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark ADS1115 sampling against a fake i2c bus")
+    parser.add_argument("--n", type=int, default=500, help="number of readings to take")
+    parser.add_argument("--rate", type=float, default=860., help="data rate (samples/sec)")
+    parser.add_argument("--latency", type=float, default=0.0003, help="time each i2c transaction takes (s)")
+    parser.add_argument("--repeats", type=int, default=3, help="number of times to repeat each method")
+    args = parser.parse_args()
+
+    print("Taking %d readings at %.0f samples/sec (%.1f ms per i2c transaction)"%(args.n, args.rate, args.latency*1000))
+
+    for name, method in [("single-shot", single_shot), ("burst", burst)]:
+        for i in range(args.repeats):
+            bus = FakeSMBus(latency=args.latency)
+            adc = ADS1115(bus=bus)
+            adc.set_rate(RATES.index(args.rate))
+            bus.transactions = 0
+            t, v = method(adc, args.n)
+            report(name, t, bus.transactions)
@@ -0,0 +1,59 @@
+from __future__ import print_function
+import datetime
+import time
+import numpy as np
+
+from utils.binning import bin_totals, HOUR
+
+#Compares binning readings into hourly totals (as is done for the plots of cumulative
+# variables) using a python loop over the readings with the vectorised numpy version
+
+
+#number of readings to bin
+N = 100000
+
+#number of times to repeat each measurement (we take the fastest)
+REPEATS = 5
+
+
+#the way the hourly totals used to be calculated: one reading at a time
+def loop_totals(t, v, start):
+    vals = np.zeros((24))
+    for i in range(len(v)):
+        dt = (t[i]-start).seconds//3600
+        vals[dt] += v[i]
+    return vals
+
+#returns the fastest time (in seconds) of REPEATS calls to func(*args)
+def time_it(func, *args):
+    best = None
+    for i in range(REPEATS):
+        t0 = time.perf_counter()
+        func(*args)
+        dt = time.perf_counter() - t0
+        if best is None or dt < best:
+            best = dt
+    return best
+
+
+if __name__ == "__main__":
+    start = datetime.datetime(year=2020, month=10, day=31)
+
+    #N readings spread randomly over the day
+    seconds = np.sort(np.random.uniform(0,24*3600,N))
+    t = [start + datetime.timedelta(seconds=s) for s in seconds]
+    t64 = np.asarray(t, dtype="datetime64[us]")
+    v = np.random.uniform(0,1,N)
+
+    #check they agree
+    expected = loop_totals(t, v, start)
+    centres, totals = bin_totals(t64, v, start, HOUR, 24)
+    assert np.allclose(expected, totals)
+
+    tloop = time_it(loop_totals, t, v, start)
+    tnumpy = time_it(bin_totals, t64, v, start, HOUR, 24)
+
+    print("Binning %d readings into hourly totals:"%N)
+    print("  python loop: %8.3f ms"%(tloop*1000))
+    print("  numpy:       %8.3f ms"%(tnumpy*1000))
+    print("  speedup:     %8.1fx"%(tloop/tnumpy))
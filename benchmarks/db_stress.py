@@ -0,0 +1,162 @@
+from __future__ import print_function
+import argparse
+import datetime
+import multiprocessing
+import os
+import random
+import sqlite3
+import tempfile
+import time
+import numpy as np
+
+from utils.db import PROFILES, get_pragmas, apply_pragmas
+
+#Concurrency stress test for the sqlite performance profiles (see utils/db.py).
+#
+# One writer process logs batches of readings (as the sensor daemons do) while N reader
+# processes repeatedly run the queries the website makes. We report the latency
+# percentiles of the readers' queries and the writer's commits, i.e. how long each had
+# to wait for the database, and how many failed with "database is locked".
+#
+# e.g. compare
+#    python -m benchmarks.db_stress --profile default --readers 4
+#    python -m benchmarks.db_stress --profile performance --readers 4
+
+
+#A cut down version of the Reading table, with the same index as the real one
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS "Reading" (
+    "id" INTEGER PRIMARY KEY AUTOINCREMENT,
+    "date" DATETIME NOT NULL,
+    "variable" TEXT NOT NULL,
+    "value" REAL NOT NULL,
+    "daykey" INTEGER
+);
+CREATE INDEX IF NOT EXISTS "idx_reading__variable_date" ON "Reading" ("variable", "date");
+'''
+
+VARIABLES = ["Power", "Energy", "Temperature", "Humidity", "Pressure"]
+
+#the queries the website makes: the latest reading and the last 24h
+LATEST = 'SELECT "date", "value" FROM "Reading" WHERE "variable" = ? ORDER BY "date" DESC LIMIT 1'
+LAST_DAY = 'SELECT COUNT(*), AVG("value") FROM "Reading" WHERE "variable" = ? AND "date" >= ?'
+
+
+def connect(dbfile, profile):
+    connection = sqlite3.connect(dbfile, isolation_level=None)
+    apply_pragmas(connection, get_pragmas(profile))
+    return connection
+
+#fills the database with 'days' days of readings (one per minute) so the queries have something to do
+def populate(dbfile, profile, days):
+    connection = connect(dbfile, profile)
+    connection.executescript(SCHEMA)
+    start = datetime.datetime.now() - datetime.timedelta(days=days)
+    rows = []
+    for i in range(days*24*60):
+        date = start + datetime.timedelta(minutes=i)
+        for variable in VARIABLES:
+            rows.append((date.isoformat(" "), variable, random.random(), int(date.strftime("%Y%m%d"))))
+    connection.execute("BEGIN")
+    connection.executemany('INSERT INTO "Reading" ("date", "variable", "value", "daykey") VALUES (?,?,?,?)', rows)
+    connection.execute("COMMIT")
+    connection.close()
+
+#logs a batch of readings every 'interval' seconds, recording how long each commit took
+def writer(dbfile, profile, duration, interval, batch, results):
+    connection = connect(dbfile, profile)
+    latencies = []
+    errors = 0
+    tend = time.time() + duration
+    while time.time() < tend:
+        now = datetime.datetime.now()
+        rows = [(now.isoformat(" "), variable, random.random(), int(now.strftime("%Y%m%d")))
+                for variable in VARIABLES for i in range(batch)]
+        t0 = time.perf_counter()
+        try:
+            connection.execute("BEGIN IMMEDIATE")
+            connection.executemany('INSERT INTO "Reading" ("date", "variable", "value", "daykey") VALUES (?,?,?,?)', rows)
+            connection.execute("COMMIT")
+            latencies.append(time.perf_counter() - t0)
+        except sqlite3.OperationalError:
+            errors += 1
+            if connection.in_transaction:
+                connection.execute("ROLLBACK")
+        time.sleep(interval)
+    connection.close()
+    results.put(("writer", latencies, errors))
+
+#runs the website's queries as fast as it can, recording how long each took
+def reader(dbfile, profile, duration, results):
+    connection = connect(dbfile, profile)
+    latencies = []
+    errors = 0
+    tend = time.time() + duration
+    while time.time() < tend:
+        variable = random.choice(VARIABLES)
+        since = (datetime.datetime.now() - datetime.timedelta(days=1)).isoformat(" ")
+        t0 = time.perf_counter()
+        try:
+            connection.execute(LATEST, (variable,)).fetchall()
+            connection.execute(LAST_DAY, (variable, since)).fetchall()
+            latencies.append(time.perf_counter() - t0)
+        except sqlite3.OperationalError:
+            errors += 1
+    connection.close()
+    results.put(("reader", latencies, errors))
+
+#prints the latency percentiles of a set of measurements
+def report(name, latencies, errors):
+    latencies = np.asarray(latencies)*1000
+    if len(latencies) == 0:
+        print("%-7s: no successful operations, %d errors"%(name, errors))
+        return
+    p50, p90, p99 = np.percentile(latencies, [50, 90, 99])
+    print("%-7s: %7d ops, %4d locked | p50 %7.2f ms | p90 %7.2f ms | p99 %7.2f ms | max %7.2f ms"
+          %(name, len(latencies), errors, p50, p90, p99, np.max(latencies)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stress test concurrent access to a sqlite database")
+    parser.add_argument("--profile", default="performance", choices=list(PROFILES), help="sqlite profile to use")
+    parser.add_argument("--readers", type=int, default=4, help="number of reader processes")
+    parser.add_argument("--duration", type=float, default=20., help="length of the test (s)")
+    parser.add_argument("--interval", type=float, default=0.05, help="time between the writer's commits (s)")
+    parser.add_argument("--batch", type=int, default=10, help="readings per variable in each of the writer's commits")
+    parser.add_argument("--days", type=int, default=30, help="days of readings to populate the database with")
+    parser.add_argument("--dir", default=None, help="directory to create the test database in (e.g. on the SD card)")
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp(dir=args.dir)
+    dbfile = os.path.join(tmpdir, "stress.sqlite")
+
+    print("Populating '%s' with %d days of readings"%(dbfile, args.days))
+    populate(dbfile, args.profile, args.days)
+
+    print("Running 1 writer and %d readers for %.0f s with the '%s' profile"%(args.readers, args.duration, args.profile))
+    results = multiprocessing.Queue()
+    processes = [multiprocessing.Process(target=writer, args=(dbfile, args.profile, args.duration, args.interval, args.batch, results))]
+    for i in range(args.readers):
+        processes.append(multiprocessing.Process(target=reader, args=(dbfile, args.profile, args.duration, results)))
+
+    for p in processes:
+        p.start()
+
+    #collect the results before joining, else the processes can block writing to the queue
+    reads = []
+    readerrors = 0
+    for i in range(len(processes)):
+        name, latencies, errors = results.get()
+        if name == "writer":
+            report("writer", latencies, errors)
+        else:
+            reads += latencies
+            readerrors += errors
+    report("readers", reads, readerrors)
+
+    for p in processes:
+        p.join()
+
+    for f in os.listdir(tmpdir):
+        os.remove(os.path.join(tmpdir, f))
+    os.rmdir(tmpdir)
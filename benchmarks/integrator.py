@@ -0,0 +1,70 @@
+from __future__ import print_function
+import numpy as np
+
+from utils import sinefit, waveforms
+from utils.integrator import EnergyIntegrator
+
+#Checks the energy integrated from bursts of readings against the exact energy of a
+# synthetic load, without hardware or waiting in real time.
+#
+# A random load (see utils/waveforms.py) is measured every BURST_INTERVAL s with a burst
+# of readings of the voltage across the burden resistor (a noisy 50Hz sinusoid on a DC
+# offset). The power fitted to each burst is integrated into per-minute energies in two
+# ways, and compared with the exact energies:
+#  - rectangles: each power held back to the previous burst, as power_monitor.py used to
+#  - trapezoids: the EnergyIntegrator in utils/integrator.py
+
+
+#length of the simulation (s)
+DURATION = 3600.
+BURST_INTERVAL = 5.
+LOG_INTERVAL = 60.
+
+#volts across the burden resistor per watt (see power_monitor.py)
+W2V = 1./(1./20*(100/50.*1000)*230)
+OFFSET = 1.65
+NOISE = 0.005
+
+
+#returns the time and measured power of a burst starting at t0
+def measure(profile, t0):
+    t = waveforms.burst_times(t0, jitter=2e-5)
+    P = waveforms.load_power(profile, t)
+    v = waveforms.sinusoid(t, P*W2V*np.sqrt(2), offset=OFFSET, noise=NOISE)
+    return np.mean(t), sinefit.fit(t, v).rms/W2V
+
+
+if __name__ == "__main__":
+    profile = waveforms.random_load(0., DURATION, interval=30., seed=1)
+
+    integrator = EnergyIntegrator(LOG_INTERVAL, LOG_INTERVAL)
+    trapezoid = []
+    rectangle = []
+    tlast = None
+    for t0 in np.arange(0., DURATION, BURST_INTERVAL):
+        t, P = measure(profile, t0)
+
+        for period in integrator.add(t, P, duration=0.58):
+            trapezoid.append(period)
+
+        if tlast is not None:
+            rectangle.append((tlast, t, P*(t - tlast)))
+        tlast = t
+
+    #the rectangles don't line up with the minutes, so split them between the minutes they overlap
+    starts = np.array([p.start for p in trapezoid])
+    ends = np.array([p.end for p in trapezoid])
+    rect = np.zeros(len(trapezoid))
+    for ta, tb, E in rectangle:
+        overlap = np.clip(np.minimum(ends, tb) - np.maximum(starts, ta), 0, None)
+        rect += E*overlap/(tb - ta)
+
+    exact = np.array([waveforms.load_energy(profile, a, b) for a, b in zip(starts, ends)])
+    trap = np.array([p.energy for p in trapezoid])
+
+    print("Energy over %d periods of %.0f s (mean %.1f Wh per period):"%(len(exact), LOG_INTERVAL, np.mean(exact)/3600))
+    for name, E in [("rectangles", rect), ("trapezoids", trap)]:
+        rel = (E - exact)/exact*100
+        print("  %-11s RMS error %.2f%% | max error %.2f%% | total error %+.3f%%"%(
+            name + ":", np.sqrt(np.mean(rel**2)), np.max(np.abs(rel)), (np.sum(E) - np.sum(exact))/np.sum(exact)*100))
+    print("  duty cycle %.1f%%"%(np.mean([p.duty for p in trapezoid])*100))
@@ -0,0 +1,60 @@
+from __future__ import print_function
+import argparse
+import threading
+import time
+import urllib.request
+import urllib.error
+import numpy as np
+
+#Load test for the website.
+#
+# Requests a url from a number of concurrent clients for a fixed time, and reports the
+# requests/sec and latency percentiles. e.g. to compare serving /data with gunicorn
+# (WSGI) and uvicorn (ASGI, with the latest data snapshot, see www/asgi.py):
+#
+#    gunicorn www.website:app
+#    python -m benchmarks.loadtest --url http://localhost:8000/data
+#
+#    uvicorn www.asgi:app --port 8000
+#    python -m benchmarks.loadtest --url http://localhost:8000/data
+
+
+#requests the url repeatedly until tend, recording the latency of each request
+def client(url, tend, latencies, errors):
+    while time.time() < tend:
+        t0 = time.perf_counter()
+        try:
+            with urllib.request.urlopen(url) as response:
+                response.read()
+            latencies.append(time.perf_counter() - t0)
+        except (urllib.error.URLError, OSError):
+            errors.append(time.perf_counter() - t0)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test a page of the website")
+    parser.add_argument("--url", default="http://localhost:8000/data", help="url to request")
+    parser.add_argument("--concurrency", type=int, default=8, help="number of concurrent clients")
+    parser.add_argument("--duration", type=float, default=20., help="length of the test (s)")
+    args = parser.parse_args()
+
+    print("Requesting %s from %d clients for %.0f s"%(args.url, args.concurrency, args.duration))
+
+    latencies = []
+    errors = []
+    t0 = time.time()
+    tend = t0 + args.duration
+    clients = [threading.Thread(target=client, args=(args.url, tend, latencies, errors)) for i in range(args.concurrency)]
+    for c in clients:
+        c.start()
+    for c in clients:
+        c.join()
+    elapsed = time.time() - t0
+
+    if len(latencies) == 0:
+        print("No successful requests (%d errors)"%len(errors))
+    else:
+        latencies = np.asarray(latencies)*1000
+        p50, p90, p99 = np.percentile(latencies, [50, 90, 99])
+        print("%d requests (%d errors) in %.1f s: %.1f requests/sec"%(len(latencies), len(errors), elapsed, len(latencies)/elapsed))
+        print("latency: p50 %.1f ms | p90 %.1f ms | p99 %.1f ms | max %.1f ms"%(p50, p90, p99, np.max(latencies)))
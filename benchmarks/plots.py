@@ -0,0 +1,48 @@
+from __future__ import print_function
+import argparse
+import time
+
+from www.website import app
+from utils import logger
+
+#Checks that plots are revalidated rather than re-sent, and times the difference.
+#
+# Requests the plot of a variable for a period from the website (with flask's test client,
+# so no server is needed), then requests it again with the ETag it came with, which should
+# get a 304 (see PlotPage in www/website.py and www/PlotCache.py), e.g.
+#
+#    python -m benchmarks.plots --variable Temperature --period latest
+
+
+#returns the response to a request for url, and how long it took (s)
+def timed_get(client, url, headers=None):
+    t0 = time.perf_counter()
+    response = client.get(url, headers=headers or {})
+    response.get_data()
+    return response, time.perf_counter() - t0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check plots are revalidated with their ETag")
+    parser.add_argument("--variable", default=None, help="variable to plot (default: the first one)")
+    parser.add_argument("--period", default="latest", help="period to plot, e.g. latest, 2020, 2020-10 or 2020-10-31")
+    args = parser.parse_args()
+
+    variable = args.variable
+    if variable is None:
+        variable = logger.get_variable_names()[0]
+    url = "/plot/%s/%s"%(variable, args.period)
+
+    client = app.test_client()
+    first, tfirst = timed_get(client, url)
+    if first.status_code != 200:
+        raise SystemExit("%s returned %d"%(url, first.status_code))
+    etag = first.headers.get("ETag")
+
+    second, tsecond = timed_get(client, url, {"If-None-Match": etag})
+    print("%s: %d (%d bytes) in %.1f ms, then %d in %.1f ms"%(url, first.status_code, len(first.get_data()),
+                                                              tfirst*1000, second.status_code, tsecond*1000))
+
+    assert second.status_code == 304, "a repeat request with If-None-Match got a %d, not a 304"%second.status_code
+    assert second.headers.get("ETag") == etag, "the plot's ETag changed between requests"
+    print("OK: the plot was revalidated")
@@ -0,0 +1,62 @@
+from __future__ import print_function
+import time
+import numpy as np
+
+from utils import sinefit
+
+#Compares the iterative fit power_monitor.py used to do (followed by the RMS of the raw
+# readings, which is what the power was calculated from) with the least squares fit in
+# utils/sinefit.py, for speed and for the accuracy of the RMS of the sinusoid.
+#
+# The readings are a burst from the ADC: N samples at 860/s of a 50Hz sinusoid on top of
+# the DC offset from the voltage divider, with noise and a little timing jitter.
+
+
+#number of readings in a burst
+N = 500
+
+#number of times to repeat each measurement (we take the fastest)
+REPEATS = 20
+
+FREQ = 50.
+OFFSET = 1.65
+AMPLITUDE = 0.2
+NOISE = 0.005
+
+
+#the way the fit used to be done. Returns the RMS it would have calculated the power from
+def iterative(t, v):
+    omega = 2*np.pi*FREQ
+    s = np.sin(omega*t)
+    c = np.cos(omega*t)
+    S0 = C0 = V0 = 0.
+    for i in range(5):
+        V0 = np.sum(v - S0*s - C0*c)/len(t)
+        S0 = np.sum((v - V0 - C0*c)*s)/np.sum(s*s)
+        C0 = np.sum((v - V0 - S0*s)*c)/np.sum(c*c)
+    return np.sqrt(np.sum(v*v)/len(v))
+
+def least_squares(t, v):
+    return sinefit.fit(t, v, FREQ).rms
+
+#returns the fastest time (in seconds) of REPEATS calls to func(*args)
+def time_it(func, *args):
+    best = None
+    for i in range(REPEATS):
+        t0 = time.perf_counter()
+        func(*args)
+        dt = time.perf_counter() - t0
+        if best is None or dt < best:
+            best = dt
+    return best
+
+
+if __name__ == "__main__":
+    t = np.arange(N)/860. + np.random.normal(0, 2e-5, N)
+    v = OFFSET + AMPLITUDE*np.sin(2*np.pi*FREQ*t + 0.3) + np.random.normal(0, NOISE, N)
+    truth = AMPLITUDE/np.sqrt(2)
+
+    print("Fitting a burst of %d readings (true RMS %.4f V):"%(N, truth))
+    for name, func in [("iterative", iterative), ("least squares", least_squares)]:
+        rms = func(t, v)
+        print("  %-14s %8.3f ms | RMS %.4f V (error %+.2f%%)"%(name + ":", time_it(func, t, v)*1000, rms, 100*(rms - truth)/truth))
@@ -8,6 +8,7 @@ import datetime
 import traceback
 
 from utils import logger, GetConfig
+from utils.buffer import BufferedLogger
 import drivers
 import sensors
 
@@ -230,6 +231,9 @@ if __name__ == "__main__":
                             description="Bedroom Barometric Pressure",
                             min=950.0,
                             max=1050.0)
+
+        #readings are buffered, and written to the database every few minutes
+        buffer = BufferedLogger("clock")
     
         
         #loop for the clock
@@ -248,18 +252,10 @@ if __name__ == "__main__":
                     
                     update_display(temp,hum,matrix)
                     
-                    logger.register_reading(variable="Temperature",
-                                            value = temp) 
-                    
-                    update_display(temp,hum,matrix)
-                                            
-                    logger.register_reading(variable="Humidity",
-                                            value = hum)
-                    
-                    update_display(temp,hum,matrix)
-                    
-                    logger.register_reading(variable="Pressure",
-                                            value = pres)
+                    #log all three readings in one go
+                    buffer.add_many([("Temperature", temp),
+                                     ("Humidity", hum),
+                                     ("Pressure", pres)])
                     
                     
                 except IOError:
@@ -1,8 +1,14 @@
 #Code to operate a ADS1115 ananlgue to digital converter
 
 from __future__ import print_function
-import smbus
 import time
+import numpy as np
+
+#smbus is only needed to talk to a real device (see FakeSMBus for testing without one)
+try:
+    import smbus
+except ImportError:
+    smbus = None
 
 #Address options for wiring:
 #0x48 - ADDR to GND
@@ -17,6 +23,24 @@ ADDRESS = 0x48
 #addresses of the registers we need to read/write to/from
 CONV_REG_ADDR = 0x00
 CONFIG_REG_ADDR = 0x01
+LO_THRESH_REG_ADDR = 0x02
+HI_THRESH_REG_ADDR = 0x03
+
+#the data rates (samples/s) corresponding to each value of DR (see below)
+RATES = [8., 16., 32., 64., 128., 250., 475., 860.]
+
+#The internal oscillator that times conversions is only accurate to 10%, so before pacing
+# reads off our own clock we measure the actual time between conversions (see calibrate).
+# If that isn't possible, we allow conversions to be this much slower than nominal
+RATE_TOLERANCE = 0.1
+
+#how long (s) calibrate watches the conversions for
+CALIBRATION_TIME = 0.5
+
+#when pacing off our own clock, we read each conversion this fraction of a conversion
+# period after we expect it to finish, so small errors in the calibration (which add up
+# over a burst) don't make us read a conversion before it is done
+READ_PHASE = 0.5
 
 #Config register
 # OS [15] 
@@ -96,8 +120,12 @@ COMP_QUE = 0x03
 
 
 
+#ready_pin is the (BCM) GPIO pin the ALERT/RDY pin is connected to, if it is. If given,
+# read_burst waits for the device to signal each conversion is ready, rather than timing them.
+#bus is the i2c bus to use (by default an smbus.SMBus on 'channel'). Pass a FakeSMBus to
+# use the driver without a device.
 class ADS1115():
-    def __init__(self,channel=CHANNEL,address=ADDRESS):
+    def __init__(self,channel=CHANNEL,address=ADDRESS,ready_pin=None,bus=None):
         #sets all the values to the defaults as defined above
         self.channel = channel
         self.address = address
@@ -111,7 +139,16 @@ class ADS1115():
         self.COMP_QUE=COMP_QUE
         
         #set up the communication bus
-        self.bus = smbus.SMBus(self.channel)
+        if bus is None:
+            if smbus is None:
+                raise ImportError("smbus is needed to talk to an ADS1115")
+            bus = smbus.SMBus(self.channel)
+        self.bus = bus
+
+        self.ready_pin = ready_pin
+        self.GPIO = None
+        #the measured time between conversions (s) at each data rate (DR), see calibrate
+        self.periods = {}
         
         #send the configuration bytes to the device
         self._send_config()
@@ -127,6 +164,209 @@ class ADS1115():
             
             return self._read()
     
+    #Takes n readings as quickly as the data rate allows, and returns the times (s, since
+    # the first reading) and voltages of the readings as numpy arrays.
+    #
+    # The device is put in continuous conversion mode for the burst (so the config register
+    # is written once, rather than once per reading) and put back in its previous mode
+    # afterwards. Each conversion is read once it is ready: when the ALERT/RDY pin signals
+    # it if ready_pin was given, otherwise when our clock says it should be, using the
+    # conversion period measured by calibrate (which is called the first time each data
+    # rate is used).
+    # The times are those the conversions finished: when ALERT/RDY signalled them, or
+    # when they were due by our clock (the reads themselves happen a little later).
+    # rate is the data rate in samples/s (one of RATES). If None the current rate is used.
+    def read_burst(self,n,rate=None):
+        t = np.empty(n)
+        raw = np.empty(n,dtype=np.int16)
+
+        self._start_continuous(rate)
+        try:
+            for i in range(n):
+                t[i], raw[i] = self._next_conversion()
+        finally:
+            self._stop_continuous()
+
+        t -= t[0] if n > 0 else 0.
+        return t, raw*(self.vmax/0x8000)
+
+    #Takes readings from several inputs (MUX values, see above) in turn, and returns the
+    # times (s, since the first reading) and voltages of each input's readings, as a list
+    # of (t, v) numpy arrays in the same order as inputs.
+    #
+    # Like read_burst, this is done in continuous mode. The inputs are read in rounds: in
+    # each round, each input is selected in turn and 'segment' readings taken from it, so
+    # each input's readings are spread over the whole burst. There are 'rounds' rounds, so
+    # each input gets rounds*segment readings.
+    # Changing the input restarts the conversion, but the signal (e.g. through an input
+    # filter) may take a while to settle, so the first 'settle' conversions after each
+    # change are thrown away.
+    def read_interleaved(self,inputs,rounds,segment,settle=1,rate=None):
+        n = rounds*segment
+        t = np.empty((len(inputs),n))
+        raw = np.empty((len(inputs),n),dtype=np.int16)
+
+        mux = self.MUX
+        self.set_input(inputs[0],update_config=False)
+        self._start_continuous(rate)
+        try:
+            for r in range(rounds):
+                for i, m in enumerate(inputs):
+                    #switching inputs takes one config write, which starts a new conversion
+                    if m != self.MUX:
+                        self.set_input(m,update_config=False)
+                        self._restart()
+                    if m != inputs[i-1] or (r == 0 and i == 0):
+                        for j in range(settle):
+                            self._next_conversion()
+                    for j in range(r*segment,(r + 1)*segment):
+                        t[i,j], raw[i,j] = self._next_conversion()
+        finally:
+            self.MUX = mux
+            self._stop_continuous()
+
+        t0 = np.min(t) if n > 0 else 0.
+        return [(t[i] - t0, raw[i]*(self.vmax/0x8000)) for i in range(len(inputs))]
+
+    #puts the device in continuous mode (at rate samples/s, see read_burst), remembering its
+    # previous mode, ready to read conversions with _next_conversion
+    def _start_continuous(self,rate=None):
+        if rate is not None:
+            if rate not in RATES:
+                raise ValueError("Rate must be one of %s"%RATES)
+            self.set_rate(RATES.index(rate),update_config=False)
+
+        self._previous_mode = self.MODE
+        if self.ready_pin is not None:
+            self._setup_ready_pin()
+        self.MODE = 0
+
+        #the time (s) between conversions, when timing them ourselves
+        if self.ready_pin is None:
+            if self.DR not in self.periods:
+                self._send_config()
+                self.calibrate()
+            self.period = self.periods[self.DR]
+        else:
+            self.period = 1./self.rate
+        self._restart()
+
+    #Measures the time between conversions at the current data rate, which may be up to
+    # RATE_TOLERANCE out from the nominal rate, by reading the conversion register as
+    # often as we can for CALIBRATION_TIME seconds and timing when its value changes.
+    # The device must be in continuous mode. The value can stay the same from one
+    # conversion to the next, so each change is counted as a whole number of (nominal)
+    # periods. If the input is too steady to see enough changes, the nominal period plus
+    # RATE_TOLERANCE is used instead, with a warning.
+    # Returns the period (s), which is also remembered for the data rate
+    def calibrate(self):
+        nominal = 1./self.rate
+        changes = []
+        tprev = time.perf_counter()
+        last = self._read_raw()
+        tend = tprev + max(CALIBRATION_TIME, 20*nominal)
+        while True:
+            val = self._read_raw()
+            now = time.perf_counter()
+            if val != last:
+                #it changed some time between the last read and this one
+                changes.append(0.5*(tprev + now))
+                last = val
+            tprev = now
+            if now > tend:
+                break
+
+        period = None
+        if len(changes) > 10:
+            dt = np.diff(changes)
+            k = np.round(dt/nominal)
+            if np.all(k >= 1):
+                period = np.sum(dt)/np.sum(k)
+                if abs(period/nominal - 1) > 1.5*RATE_TOLERANCE:
+                    period = None
+
+        if period is None:
+            print("Warning: Unable to calibrate the ADC's data rate (is the input connected?). Assuming it is %d%% slow"%(RATE_TOLERANCE*100))
+            period = (1. + RATE_TOLERANCE)*nominal
+
+        self.periods[self.DR] = period
+        return period
+
+    #writes the config, which starts a new conversion
+    def _restart(self):
+        self._send_config()
+        self.due = time.perf_counter()
+        #forget any conversion that finished before this one
+        if self.ready_pin is not None:
+            self.GPIO.event_detected(self.ready_pin)
+
+    #waits for the next conversion and reads it, returning the time it finished and its raw value
+    def _next_conversion(self):
+        if self.ready_pin is not None:
+            self._wait_ready(self.period*10)
+            return time.perf_counter(), self._read_raw()
+
+        self.due += self.period
+        tread = self.due + READ_PHASE*self.period
+        #sleep for most of the wait, then spin for the rest, as sleep is not precise
+        wait = tread - time.perf_counter()
+        if wait > 0.002:
+            time.sleep(wait - 0.001)
+        while time.perf_counter() < tread:
+            pass
+
+        return self.due, self._read_raw()
+
+    #puts the device back in the mode it was in before _start_continuous
+    def _stop_continuous(self):
+        self.MODE = self._previous_mode
+        self._send_config()
+        if self.ready_pin is not None:
+            self._teardown_ready_pin()
+
+    #sets up the ALERT/RDY pin to pulse when each conversion is ready. To do this the
+    # comparator needs to be on, and the thresholds' most significant bits set to 1 (high)
+    # and 0 (low)
+    def _setup_ready_pin(self):
+        import RPi.GPIO as GPIO
+        self.GPIO = GPIO
+        self.bus.write_i2c_block_data(self.address,HI_THRESH_REG_ADDR,[0x80,0x00])
+        self.bus.write_i2c_block_data(self.address,LO_THRESH_REG_ADDR,[0x00,0x00])
+        self.COMP_QUE = 0x00
+
+        GPIO.setmode(GPIO.BCM)
+        GPIO.setup(self.ready_pin,GPIO.IN,pull_up_down=GPIO.PUD_UP)
+        #the pulse is only ~8us long, so we let GPIO catch the edge rather than polling the pin
+        GPIO.add_event_detect(self.ready_pin,GPIO.FALLING)
+
+    def _teardown_ready_pin(self):
+        self.GPIO.remove_event_detect(self.ready_pin)
+        self.COMP_QUE = COMP_QUE
+        self._send_config()
+
+    #waits for the ALERT/RDY pin to signal a conversion is ready
+    def _wait_ready(self,timeout):
+        tend = time.perf_counter() + timeout
+        while not self.GPIO.event_detected(self.ready_pin):
+            if time.perf_counter() > tend:
+                raise ValueError("Timed out waiting for the ADC's ALERT/RDY pin")
+
+    #reads the conversion register, returning the (signed) raw value.
+    # Makes 10 attempts to read it before giving up
+    def _read_raw(self):
+        for attempt in range(10):
+            try:
+                vals = self.bus.read_i2c_block_data(self.address,CONV_REG_ADDR,2)
+                break
+            except IOError:
+                if attempt == 9:
+                    raise ValueError("Cannot get a reading from the ADC")
+
+        val = (vals[0]<<8)|(vals[1])
+        if val >= 0x8000:
+            val = val - 0x10000
+        return val
+
     #sets the data rate. See above for the values
     def set_rate(self,dr,update_config=True):
         if dr < 0 or dr > 7:
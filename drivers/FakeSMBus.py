@@ -0,0 +1,85 @@
+from __future__ import print_function
+import time
+import math
+
+#A stand-in for smbus.SMBus that pretends to be an ADS1115, so the ADS1115 driver can be
+# tested and benchmarked without a device, e.g.
+#
+#    adc = ADS1115(bus=FakeSMBus())
+#    t, v = adc.read_burst(500, rate=860)
+#
+# It keeps the config register the driver writes, and works out what the conversion
+# register would hold when it is read: in continuous mode the last conversion finished
+# (conversions happen every 1/rate s from when the config was written), and in single-shot
+# mode the conversion started by the last config write, once it has had time to finish.
+# The input voltage at time t (s) is given by signal (by default a 50Hz sine), and is
+# quantised and clipped as the gain (PGA) would. signal can also be a dictionary of
+# {MUX value: signal}, to give each input a different signal.
+#
+# Each transaction takes 'latency' seconds, roughly what a 100kHz i2c bus takes to do one.
+# The number of transactions made is counted in 'transactions'.
+
+#the data rates (samples/s) for each value of DR
+RATES = [8., 16., 32., 64., 128., 250., 475., 860.]
+#the full scale voltage for each value of PGA
+VMAX = [6.144, 4.096, 2.048, 1.024, 0.512, 0.256, 0.256, 0.256]
+
+
+def sine(t, amplitude=1., frequency=50.):
+    return amplitude*math.sin(2*math.pi*frequency*t)
+
+
+class FakeSMBus():
+    def __init__(self, signal=sine, latency=0.0003):
+        self.signal = signal
+        self.latency = latency
+        self.transactions = 0
+
+        self.registers = {0x01: [0x85, 0x83], 0x02: [0x80, 0x00], 0x03: [0x7f, 0xff]}
+        self.t0 = time.perf_counter()
+        #when the current conversion (or run of conversions) started
+        self.tstart = self.t0
+
+    def _transaction(self):
+        self.transactions += 1
+        if self.latency > 0:
+            tend = time.perf_counter() + self.latency
+            while time.perf_counter() < tend:
+                pass
+
+    def write_i2c_block_data(self, address, register, data):
+        self._transaction()
+        self.registers[register] = list(data)
+        if register == 0x01:
+            self.tstart = time.perf_counter()
+
+    def read_i2c_block_data(self, address, register, length):
+        self._transaction()
+        if register != 0x00:
+            return self.registers[register][:length]
+
+        config = self.registers[0x01]
+        continuous = (config[0] & 0x01) == 0
+        rate = RATES[config[1] >> 5]
+        vmax = VMAX[(config[0] >> 1) & 0x07]
+        signal = self.signal
+        if isinstance(signal, dict):
+            signal = signal[(config[0] >> 4) & 0x07]
+
+        #the time the latest finished conversion sampled the input
+        now = time.perf_counter()
+        conversions = int((now - self.tstart)*rate)
+        if conversions == 0:
+            #the first conversion isn't done, so the register still holds whatever it did
+            return self.registers.get(0x00, [0x00, 0x00])[:length]
+        if not continuous:
+            conversions = 1
+        tsample = self.tstart + conversions/rate - self.t0
+
+        val = int(round(signal(tsample)/vmax*0x8000))
+        val = max(-0x8000, min(0x7fff, val))
+        if val < 0:
+            val += 0x10000
+
+        self.registers[0x00] = [val >> 8, val & 0xff]
+        return self.registers[0x00][:length]
@@ -2,3 +2,4 @@ from .PCF8591 import PCF8591
 from .SN74HC595 import SN74HC595
 from .LEDMatrix import LEDMatrix
 from .ADS1115 import ADS1115
+from .FakeSMBus import FakeSMBus
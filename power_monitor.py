@@ -3,8 +3,14 @@ import numpy as np
 import matplotlib.pyplot as plt
 from drivers import ADS1115
 import time
+import json
 import datetime
 import utils.logger as logger
+from utils import GetConfig
+from utils.buffer import BufferedLogger
+from utils import sinefit
+from utils.integrator import Scheduler, EnergyIntegrator
+from utils.capture import RingWriter
 
 
 # Wiring
@@ -46,7 +52,7 @@ V_RMS = 230
 ##Various derived constants
 
 #Angular frequency
-omega = 2 * np.pi*50 #2*pi*f
+omega = 2 * np.pi*freq #2*pi*f
 #converts voltage to current in the transformer coil
 # I = V/R: 1V = 1/R A
 V2mA = 1./R 
@@ -54,125 +60,155 @@ V2mA = 1./R
 mA2A = Amax/mAmax*1000
 
 
+#converts the RMS voltage across the burden resistor to power
+V2W = V2mA*mA2A*V_RMS
+
+
+#A circuit whose current is measured by a current transformer on one of the ADC's inputs.
+# name - the name of the circuit (e.g. Oven)
+# input - the ADC input (MUX value, see drivers/ADS1115.py) the transformer is read on
+# burden - the burden resistor (Ohms)
+# amps - the peak wall current the transformer is rated for (Amps)
+# mA - the current induced at that rating (mA)
+# power_variable, energy_variable - the variables its power and energy are logged as
+#  (by default "<name> Power" and "<name> Energy")
+class Circuit:
+    def __init__(self,name,input=0,burden=R,amps=Amax,mA=mAmax,power_variable=None,energy_variable=None):
+        self.name = name
+        self.input = input
+        self.V2W = 1./burden*(amps/float(mA)*1000)*V_RMS
+        self.power_variable = power_variable or "%s Power"%name
+        self.energy_variable = energy_variable or "%s Energy"%name
+        #integrates the circuit's power (see utils/integrator.py)
+        self.integrator = None
+
+#returns the circuits defined in config (see power_monitor in config.yaml). If none are,
+# there is one on input 0 with the default settings above, logged as Power and Energy
+def get_circuits(config):
+    circuits = config.get("circuits")
+    if not circuits:
+        return [Circuit("Mains",power_variable="Power",energy_variable="Energy")]
+    return [Circuit(**circuit) for circuit in circuits]
+
+
 # returns the resolution of the ADC (in W)
-def get_error(adc):
+def get_error(adc,circuit=None):
     dV=adc.get_resolution()
-    dmA = dV*V2mA
-    dA = dmA*mA2A
-    dP = dA*V_RMS
-    return dP
+    return dV*(circuit.V2W if circuit is not None else V2W)
 
 # Returns the maximum power that can be measured
-def get_max_power(adc):
+def get_max_power(adc,circuit=None):
     vmax = adc.get_vmax()
     #vmax = 3.3/2
-    mAmax = V2mA*vmax
-    Amax = mA2A*mAmax
-    Pmax = Amax*V_RMS
-    return Pmax
+    return vmax*(circuit.V2W if circuit is not None else V2W)
 
-#Reads the voltage across the curent transformer N times
-def take_readings(adc):
-    
-    #tell the ADC to use A0 and A1 inputs
-    adc.set_input(0)
-    #tell ADC to take highest temporal resolution of data points
-    adc.set_rate(7)
-    
-    vs = np.zeros(N)
-    ts = np.zeros(N)
-    
-    adc.set_mode(1)
-    
-    t0 = time.time()
+#Reads the voltage across the curent transformers, as quickly as the ADC can (860 readings/s,
+# so 500 readings span ~0.6s, or ~30 cycles of the AC). Returns a list of the (t, v)
+# readings of each circuit.
+# With one circuit, N readings are taken in one continuous burst. With more, the ADC's
+# input is switched between them every 'segment' readings (so each circuit's readings
+# are spread over the burst) with 'settle' readings thrown away after each switch, and
+# each circuit gets about N/(number of circuits) readings
+def take_readings(adc,circuits,segment=35,settle=1):
     
-    for i in range(N):
-        for attempt in range(10):
-            val = adc.read()
-            if val is not None:
-                vs[i]= val
-                ts[i] = time.time()-t0
-                break
-            if attempt == 9:
-                raise ValueError("Cannot get a reading from the ADC")
+    if len(circuits) == 1:
+        adc.set_input(circuits[0].input,update_config=False)
+        return [adc.read_burst(N,rate=860.)]
     
-    return ts, vs
+    rounds = max(1,N//(segment*len(circuits)))
+    return adc.read_interleaved([c.input for c in circuits],rounds,segment,settle,rate=860.)
 
 
 
-# Calculate the power from the voltage readings
-def get_power(t,v):
-    
-    # fit V(t) = V0 + S*sin(omega*t) + C*cos(omega*t)
-    s = np.sin(omega*t)
-    c = np.cos(omega*t)
-    
-    S0=0.
-    C0=0.
-    V0=0.
-    
-    #iterate 5 times
-    for i in range(5):
-        V0 = np.sum(v - S0*s - C0*c)/len(t)
-        S0 = np.sum((v - V0 - C0*c)*s)/np.sum(s*s)
-        C0 = np.sum((v - V0 - S0*s)*c)/np.sum(c*c)
-        #print("Iteration %d: V0=%f, C0=%f. S0=%f"%(i,V0,C0,S0))
-    
-    A0 = np.sqrt(C0*C0 + S0*S0)
-    #print("Sinusoidal amplitude = %fV"%A0)
-    #print("RMS Sinusoidal amplitude = %fV"%(A0/np.sqrt(2)))
-        
+# Calculate the power from the voltage readings.
+# A sinusoid at the mains frequency is fitted to the readings (see utils/sinefit.py), and
+# its RMS (which leaves out the DC offset from the voltage divider, and the noise) is
+# converted to the RMS current in the wire.
+# Returns the power and its uncertainty (W): the resolution of the ADC (in W, see
+# get_error) plus the statistical error on the RMS from the noise in the readings
+def get_power(t,v,resolution=0.,circuit=None):
     
-    #Better (?) method is to just calculate the RMS value firectly from the data
-    
-    A = (np.max(v) - np.min(v))/2.
-    #print("Signal amplitude = %fV"%A)
-    rms = np.sqrt(np.sum(v*v)/len(v))
-    #print("RMS signal = %fV"%rms)
+    fit = sinefit.fit(t,v,freq)
    
-    mA = rms*V2mA
-    A = mA*mA2A
-    #print("Current (RMS) in transformer = %fmA"%(mA*1000))
-    #print("Current (RMS) in wire = %fA"%(A))
-    P = A*V_RMS
+    v2w = circuit.V2W if circuit is not None else V2W
+    P = fit.rms*v2w
+    dP = resolution + fit.noise/np.sqrt(len(v))*v2w
     
-    return P
+    return P, dP
     
 
 if __name__ == "__main__":
-    adc = ADS1115()
-    #dP = get_error(adc)
-    #Pmax = get_max_power(adc)
+    config = GetConfig(key="power_monitor")
+    adc = ADS1115(ready_pin=config.get("ready_pin"))
+    circuits = get_circuits(config)
+    segment = config.get("segment", 35)
+    settle = config.get("settle", 1)
     
     logger.init()
-    logger.register_variable("Power","Watts","Power consumption",min=0)
-    logger.register_variable("Energy","kWh","Energy consumed",min=0,cumulative=True)
+    for circuit in circuits:
+        logger.register_variable(circuit.power_variable,"Watts","Power consumption (%s)"%circuit.name,min=0)
+        logger.register_variable(circuit.energy_variable,"kWh","Energy consumed (%s)"%circuit.name,min=0,cumulative=True)
+
+    #readings are buffered, and written to the database every few minutes
+    buffer = BufferedLogger("power_monitor")
+    
+    #Take a burst of readings every burst_interval seconds, and log the mean power and the
+    # energy used every log_interval seconds (on the wall clock, e.g. on the minute)
+    burst_interval = config.get("burst_interval", 5)
+    log_interval = config.get("log_interval", 60)
+    
+    schedule = Scheduler(burst_interval)
+    
+    #optionally keep the raw readings, for offline analysis
+    capture = None
+    if config.get("capture_file"):
+        capture = RingWriter(config["capture_file"],config.get("capture_frames",8640)*len(circuits),N)
     
     #main loop for taking measurements
-    t0=time.time()
     while True:
-        p = 0
-        ttot = 0
-        #take 10 power measurements, and log the time-averaged power and energy over these measurements
-        for i in range(10):
-            t,v, = take_readings(adc)
-            P = get_power(t,v)
-            
-            timestamp = datetime.datetime.now()
-            t1=time.time()
-            print("%s: %d W"%(timestamp,P))
+        schedule.wait()
+        
+        #if the clock has been set (e.g. by NTP after booting) re-align the periods to it
+        if schedule.sync_clock():
+            print("Warning: The clock has changed, re-aligning to it")
+            for circuit in circuits:
+                if circuit.integrator is not None:
+                    circuit.integrator.realign(schedule.aligned(log_interval, circuit.integrator.last[0]))
+        
+        t0 = time.monotonic()
+        bursts = take_readings(adc,circuits,segment,settle)
+        t1 = time.monotonic()
+        #the powers are means over the burst, so we take them to be the powers at its middle
+        tmid = t0 + (t1-t0)/2
+        
+        #the readings for every circuit completed this cycle, written in one go
+        readings = []
+        for i, (circuit, (t,v)) in enumerate(zip(circuits, bursts)):
+            if capture is not None:
+                capture.append(t,v,channel=i,timestamp=tmid+schedule.offset)
             
-            p += P*(t1-t0)
-            ttot += (t1-t0)
+            P, error = get_power(t,v,get_error(adc,circuit),circuit)
+            print("%s: %s %d +/- %d W"%(schedule.to_datetime(tmid),circuit.name,P,error))
             
-            time.sleep(5)
-            t0=t1
+            if circuit.integrator is None:
+                circuit.integrator = EnergyIntegrator(log_interval, schedule.aligned(log_interval, tmid))
             
-        pavg = p/ttot
-        print("Average power = %dW"%pavg)
-        kWh = pavg*ttot/3600/1000
-        print("Energy = %fkWh"%kWh)
-        
-        logger.register_reading(variable="Power",value=pavg)
-        logger.register_reading(variable="Energy",value=kWh)
+            #the time the circuit was measured for (the burst is shared between the circuits)
+            duration = (t1-t0)/len(circuits)
+            for period in circuit.integrator.add(tmid, P, error, duration):
+                kWh = period.energy/3600/1000
+                print("%s: Average power = %dW, Energy = %fkWh (+/- %f), measuring %.1f%% of the time"%(circuit.name,period.power,kWh,period.error/3600/1000,period.duty*100))
+                
+                #the readings' uncertainties (W and kWh) and how they were measured, as json
+                # (like all reading metadata)
+                measured = {"duty": round(period.duty,3), "samples": period.samples}
+                power_metadata = json.dumps(dict(measured, error=period.error/(period.end-period.start)))
+                energy_metadata = json.dumps(dict(measured, error=period.error/3600/1000))
+                date = schedule.to_datetime(period.end)
+                readings.append((circuit.power_variable,period.power,date,power_metadata))
+                readings.append((circuit.energy_variable,kWh,date,energy_metadata))
         
+        if len(readings) > 0:
+            if schedule.missed > 0:
+                print("Warning: %d bursts missed so far"%schedule.missed)
+            buffer.add_many(readings)
@@ -0,0 +1,66 @@
+import numpy as np
+
+#Vectorised binning of readings into fixed width time bins (e.g. hourly totals).
+#
+# Times are numpy datetime64 arrays and values float64 arrays. Bins are 'width' wide
+# (a numpy timedelta64) starting at 'start', so reading i falls in bin
+# (t[i]-start)//width.
+
+#Commonly used bin widths
+QUARTER_HOUR = np.timedelta64(15,'m')
+HOUR = np.timedelta64(1,'h')
+DAY = np.timedelta64(1,'D')
+
+
+#converts a list of datetimes (or a datetime64 array) to a datetime64 array
+def to_datetime64(t):
+    return np.asarray(t, dtype="datetime64[us]")
+
+#returns the index of the bin each time falls in
+def bin_index(t, start, width):
+    t = to_datetime64(t)
+    width = np.timedelta64(width,"us")
+    return ((t - np.datetime64(start,"us")) // width).astype(np.int64)
+
+
+#Returns the centres of nbins bins, and the total of the values falling in each bin.
+# Values outside the bins are ignored
+def bin_totals(t, v, start, width, nbins):
+    v = np.asarray(v, dtype=np.float64)
+    index = bin_index(t, start, width)
+
+    inrange = (index >= 0) & (index < nbins)
+    totals = np.bincount(index[inrange], weights=v[inrange], minlength=nbins)
+
+    width = np.timedelta64(width,"us")
+    centres = np.datetime64(start,"us") + width*np.arange(nbins) + width//2
+
+    return centres, totals
+
+
+#Returns statistics for each (non-empty) bin of a set of readings, sorted by time.
+# Returns a dictionary of arrays, one element per non-empty bin:
+#    index  - the bin's index
+#    count  - the number of values in the bin
+#    total  - the sum of the values
+#    minval - the smallest value
+#    maxval - the largest value
+def bin_statistics(t, v, start, width):
+    v = np.asarray(v, dtype=np.float64)
+    index = bin_index(t, start, width)
+
+    if len(index) == 0:
+        empty = np.zeros(0)
+        return {"index": np.zeros(0,dtype=np.int64), "count": np.zeros(0,dtype=np.int64),
+                "total": empty, "minval": empty, "maxval": empty}
+
+    #the readings are sorted by time, so each bin is a contiguous run of readings
+    starts = np.flatnonzero(np.r_[True, index[1:] != index[:-1]])
+
+    return {
+        "index": index[starts],
+        "count": np.diff(np.r_[starts, len(index)]),
+        "total": np.add.reduceat(v, starts),
+        "minval": np.minimum.reduceat(v, starts),
+        "maxval": np.maximum.reduceat(v, starts),
+    }
@@ -0,0 +1,215 @@
+import os
+import json
+import atexit
+import datetime
+import threading
+import collections
+import pony.orm as pny
+
+from . import db
+from . import logger
+
+#A buffered front end to the logger, for the sensor daemons.
+#
+# Committing every reading to the database as it is taken means a sqlite transaction
+# (and several fsyncs of the SD card) per reading. Instead, readings added with add()
+# are held in memory and written to the database together, in one transaction, every
+# flush_interval seconds or every flush_size readings (whichever comes first).
+#
+# So that a crash or power cut doesn't lose the buffered readings, each reading is also
+# appended to a small journal file as it is added (one JSON list per line). The journal
+# is emptied once its readings have been committed to the database, and any readings
+# left in it (e.g. after a crash) are written to the database when the buffer is next
+# created. Readings that did make it into the database before the crash are skipped.
+# If that fails (e.g. the database is locked), the journal is kept and its readings are
+# written at the next flush instead.
+#
+# The buffer holds at most max_size readings. If the database can't be written to for so
+# long that it fills up, the oldest readings are dropped (with a warning), and the journal
+# is rewritten now and then so it doesn't grow without limit either.
+#
+# e.g.
+#    logger.init()
+#    buffer = BufferedLogger("power_monitor")
+#    buffer.add("Power", 123.)
+#
+# Make sure logger.init() has been called (and the variables registered) first.
+class BufferedLogger:
+    def __init__(self, name, flush_interval=None, flush_size=None, journaldir=None, fsync=None, max_size=None):
+        config = logger.dbconfig
+
+        self.flush_interval = flush_interval if flush_interval is not None else config.get("buffer_flush_interval", 300)
+        self.flush_size = flush_size if flush_size is not None else config.get("buffer_flush_size", 100)
+        self.max_size = max_size if max_size is not None else config.get("buffer_max_size", 10000)
+        #whether to fsync the journal after every reading (otherwise it is only fsynced before each flush)
+        self.fsync = fsync if fsync is not None else config.get("journal_fsync", True)
+
+        if journaldir is None:
+            journaldir = config.get("journaldir", os.path.join(logger.dbdir, "journal"))
+        if not os.path.isdir(journaldir):
+            os.makedirs(journaldir)
+        self.journalfile = os.path.join(journaldir, "%s.journal"%name)
+
+        #readings waiting to be written to the database, as (variable, value, date, metadata)
+        self.buffer = collections.deque(maxlen=self.max_size)
+        self.last_flush = datetime.datetime.now()
+        self.lock = threading.RLock()
+        #journalled readings from last time that we haven't been able to write yet
+        self.unreplayed = []
+        #the number of readings in the journal
+        self.journalled = 0
+        #the number of readings dropped because the buffer was full
+        self.dropped = 0
+
+        #write any readings left over from last time to the database
+        self.replay()
+
+        self.journal = open(self.journalfile, "a")
+
+        #and write whatever is in the buffer before we exit
+        atexit.register(self.flush)
+
+    #adds a reading to the buffer, flushing the buffer if it is due.
+    # date defaults to now
+    def add(self, variable, value, date=None, metadata=""):
+        self.add_many([(variable, value, date, metadata)])
+
+    #Adds several readings at once, with one write (and fsync) of the journal.
+    # readings are (variable, value) or (variable, value, date, metadata) tuples. Readings
+    # without a date of their own are given 'date', which defaults to now
+    def add_many(self, readings, date=None):
+        if date is None:
+            date = datetime.datetime.now()
+
+        entries = []
+        for reading in readings:
+            variable, value = reading[:2]
+            rdate = reading[2] if len(reading) > 2 and reading[2] is not None else date
+            metadata = reading[3] if len(reading) > 3 else ""
+            entries.append((variable, value, rdate, metadata))
+
+        with self.lock:
+            self.journal.write("".join(_dumps(entry) + "\n" for entry in entries))
+            self.journal.flush()
+            if self.fsync:
+                os.fsync(self.journal.fileno())
+            self.journalled += len(entries)
+
+            dropped = len(self.buffer) + len(entries) - self.max_size
+            if dropped > 0:
+                self.dropped += dropped
+                print("Warning: Buffer full, dropping the %d oldest reading(s) (%d dropped so far)"%(dropped, self.dropped))
+            self.buffer.extend(entries)
+
+            #once the journal holds many more readings than the buffer (because the
+            # dropped ones are still in it), rewrite it with just the buffer's
+            if dropped > 0 and self.journalled > 2*self.max_size:
+                self._rewrite_journal()
+
+            if self.due():
+                self.flush()
+
+    #returns True if the buffer should be written to the database
+    def due(self):
+        if len(self.buffer) >= self.flush_size:
+            return True
+        return (datetime.datetime.now() - self.last_flush).total_seconds() >= self.flush_interval
+
+    #writes the buffered readings to the database in one transaction, then empties the journal.
+    # If this fails (e.g. the database is locked) the readings stay in the buffer (and
+    # journal) and we try again at the next flush
+    def flush(self):
+        with self.lock:
+            self.last_flush = datetime.datetime.now()
+            if len(self.buffer) == 0 and len(self.unreplayed) == 0:
+                return
+
+            #make sure the journal is on disk before we start writing to the database
+            self.journal.flush()
+            os.fsync(self.journal.fileno())
+
+            if len(self.unreplayed) > 0:
+                if not self._replay(self.unreplayed):
+                    return
+                self.unreplayed = []
+
+            if len(self.buffer) > 0:
+                try:
+                    logger.register_readings(list(self.buffer))
+                except Exception as e:
+                    print("Warning: Unable to write %d buffered reading(s) to the database: %s"%(len(self.buffer),e))
+                    return
+
+            self.buffer.clear()
+            self.journal.truncate(0)
+            self.journalled = 0
+
+    #rewrites the journal with the readings in the buffer (and any still to be replayed)
+    def _rewrite_journal(self):
+        entries = list(self.unreplayed) + list(self.buffer)
+        tmp = self.journalfile + ".tmp"
+        with open(tmp, "w") as f:
+            f.write("".join(_dumps(entry) + "\n" for entry in entries))
+            f.flush()
+            os.fsync(f.fileno())
+        self.journal.close()
+        os.replace(tmp, self.journalfile)
+        self.journal = open(self.journalfile, "a")
+        self.journalled = len(entries)
+
+    #Writes any readings in the journal that aren't already in the database to the database.
+    # If that fails, the journal is kept, and we try again at the next flush
+    def replay(self):
+        if not os.path.exists(self.journalfile):
+            return
+
+        entries = collections.OrderedDict()
+        with open(self.journalfile) as f:
+            for line in f:
+                try:
+                    entry = _loads(line)
+                except (ValueError, TypeError):
+                    #a partially written line from when we crashed
+                    continue
+                entries[(entry[0], entry[2])] = entry
+
+        if self._replay(list(entries.values())):
+            os.remove(self.journalfile)
+        else:
+            self.unreplayed = list(entries.values())
+            self.journalled = len(self.unreplayed)
+
+    #writes the journalled entries that aren't already in the database to it. Returns
+    # whether this succeeded
+    def _replay(self, entries):
+        try:
+            missing = _not_in_database(entries)
+            if len(missing) > 0:
+                print("Replaying %d reading(s) from journal '%s'"%(len(missing), self.journalfile))
+                logger.register_readings(missing)
+        except Exception as e:
+            print("Warning: Unable to replay %d journalled reading(s) from '%s': %s"%(len(entries), self.journalfile, e))
+            return False
+        return True
+
+
+#returns the entries whose (variable, date) is not already in the database
+@pny.db_session
+def _not_in_database(entries):
+    missing = []
+    for entry in entries:
+        variable = db.Variable.get(name=entry[0])
+        if variable is None:
+            print("Warning: Dropping journalled reading of unknown variable '%s'"%entry[0])
+        elif not db.Reading.exists(variable=variable, date=entry[2]):
+            missing.append(entry)
+    return missing
+
+#(de)serialises a (variable, value, date, metadata) journal entry
+def _dumps(entry):
+    variable, value, date, metadata = entry
+    return json.dumps([variable, value, date.isoformat(" "), metadata])
+
+def _loads(line):
+    variable, value, date, metadata = json.loads(line)
+    return (variable, value, datetime.datetime.fromisoformat(date), metadata)
@@ -0,0 +1,178 @@
+import os
+import sys
+import time
+import numpy as np
+
+#Capturing raw waveforms (e.g. the power monitor's bursts of readings) to a fixed size
+# ring file, for looking at them later.
+#
+# The file holds 'nframes' frames. Each frame is a burst's times and values (as float32),
+# of up to 'frame_samples' samples. When the file is full, the oldest frame is overwritten,
+# so it never grows, and as the file is memory mapped, appending a frame just copies the
+# arrays into it, without allocating anything.
+#
+# The file is laid out as:
+#  - a header (HEADER_SIZE bytes): the magic string, version, frame_samples, nframes, and
+#    the number of frames ever written (count)
+#  - the index: one record per frame of its sequence number (the count when it was
+#    written), timestamp (wall clock, s since the epoch), number of samples and channel
+#    (e.g. which circuit it was from)
+#  - the data: an array of shape (nframes, 2, frame_samples), the times and values of
+#    each frame
+# Frame seq is in slot seq % nframes. The writer fills in a frame's data, then its index
+# record, then the count, so a reader never sees a frame before it is written.
+#
+# e.g.
+#    writer = RingWriter("waveforms.ring", nframes=8640, frame_samples=500)
+#    writer.append(t, v, channel=0)
+#
+#    reader = RingReader("waveforms.ring")
+#    for info, t, v in reader.frames():
+#        ...
+#
+# 'python -m utils.capture <file>' summarises the frames in a file.
+
+MAGIC = b"PIWAVE01"
+VERSION = 1
+HEADER_SIZE = 64
+
+HEADER_DTYPE = np.dtype([("magic", "S8"), ("version", "<u4"), ("frame_samples", "<u4"),
+                         ("nframes", "<u8"), ("count", "<u8")])
+INDEX_DTYPE = np.dtype([("seq", "<u8"), ("time", "<f8"), ("samples", "<u4"), ("channel", "<u4")])
+DATA_DTYPE = np.dtype("<f4")
+
+
+#returns the size (bytes) of a ring file
+def file_size(nframes, frame_samples):
+    return HEADER_SIZE + nframes*INDEX_DTYPE.itemsize + nframes*2*frame_samples*DATA_DTYPE.itemsize
+
+#memory maps the header, index and data of a ring file (mode as for np.memmap)
+def _map(path, mode):
+    header = np.memmap(path, dtype=HEADER_DTYPE, mode=mode, shape=(1,))
+    if header["magic"][0] != MAGIC:
+        raise ValueError("%s is not a waveform capture file"%path)
+    if header["version"][0] != VERSION:
+        raise ValueError("%s is version %d of the format, not %d"%(path, header["version"][0], VERSION))
+
+    nframes = int(header["nframes"][0])
+    frame_samples = int(header["frame_samples"][0])
+    index = np.memmap(path, dtype=INDEX_DTYPE, mode=mode, offset=HEADER_SIZE, shape=(nframes,))
+    data = np.memmap(path, dtype=DATA_DTYPE, mode=mode, offset=HEADER_SIZE + nframes*INDEX_DTYPE.itemsize,
+                     shape=(nframes, 2, frame_samples))
+    return header, index, data
+
+
+#Appends frames to a ring file, creating it if it doesn't exist. If it does exist, it must
+# have the same nframes and frame_samples
+class RingWriter:
+    def __init__(self, path, nframes, frame_samples):
+        self.path = path
+        if not os.path.exists(path):
+            self._create(path, nframes, frame_samples)
+
+        self.header, self.index, self.data = _map(path, "r+")
+        if self.header["nframes"][0] != nframes or self.header["frame_samples"][0] != frame_samples:
+            raise ValueError("%s holds %d frames of %d samples, not %d of %d (remove it to start a new one)"%(
+                path, self.header["nframes"][0], self.header["frame_samples"][0], nframes, frame_samples))
+        self.nframes = nframes
+        self.frame_samples = frame_samples
+
+    #creates an empty ring file. It is written to a temporary file first, so there is never
+    # a half made file at path
+    @staticmethod
+    def _create(path, nframes, frame_samples):
+        directory = os.path.dirname(path)
+        if directory != "" and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.truncate(file_size(nframes, frame_samples))
+        header = np.memmap(tmp, dtype=HEADER_DTYPE, mode="r+", shape=(1,))
+        header[0] = (MAGIC, VERSION, frame_samples, nframes, 0)
+        header.flush()
+        del header
+        os.rename(tmp, path)
+
+    #Appends a frame of times t and values v (only the first frame_samples are kept).
+    # channel is stored with it, and timestamp (s since the epoch) defaults to now
+    def append(self, t, v, channel=0, timestamp=None):
+        if timestamp is None:
+            timestamp = time.time()
+        n = min(len(t), self.frame_samples)
+
+        seq = int(self.header["count"][0])
+        slot = seq % self.nframes
+
+        frame = self.data[slot]
+        frame[0, :n] = t[:n]
+        frame[1, :n] = v[:n]
+        self.index[slot] = (seq, timestamp, n, channel)
+        self.header["count"] = seq + 1
+
+    #writes the changes to the file (they are written by the OS anyway, eventually)
+    def flush(self):
+        self.data.flush()
+        self.index.flush()
+        self.header.flush()
+
+
+#Reads the frames in a ring file, without copying them: the arrays returned are views of
+# the memory mapped file. If the file is still being written to, the oldest frames will be
+# overwritten as it wraps around, so copy any frames that need to outlive that
+class RingReader:
+    def __init__(self, path):
+        self.path = path
+        self.header, self.index, self.data = _map(path, "r")
+        self.nframes = int(self.header["nframes"][0])
+        self.frame_samples = int(self.header["frame_samples"][0])
+
+    #returns the sequence numbers of the frames in the file, oldest first
+    def sequence(self):
+        count = int(self.header["count"][0])
+        return range(max(0, count - self.nframes), count)
+
+    def __len__(self):
+        return len(self.sequence())
+
+    #Returns frame seq, as (info, t, v), where info is its index record (seq, time, samples
+    # and channel). Raises KeyError if it has been overwritten (or not written yet)
+    def frame(self, seq):
+        slot = seq % self.nframes
+        info = self.index[slot]
+        if info["seq"] != seq or seq >= self.header["count"][0]:
+            raise KeyError("Frame %d is not in %s"%(seq, self.path))
+        n = info["samples"]
+        return info, self.data[slot, 0, :n], self.data[slot, 1, :n]
+
+    #Yields the frames (as (info, t, v), see frame), oldest first. Only those from channel
+    # and/or since 'since' (s since the epoch) are returned if they are given
+    def frames(self, channel=None, since=None):
+        for seq in self.sequence():
+            slot = seq % self.nframes
+            info = self.index[slot]
+            if channel is not None and info["channel"] != channel:
+                continue
+            if since is not None and info["time"] < since:
+                continue
+            try:
+                yield self.frame(seq)
+            except KeyError:
+                #overwritten by the writer while we were reading
+                continue
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("Usage: python -m utils.capture <file>")
+        sys.exit(1)
+
+    reader = RingReader(sys.argv[1])
+    seqs = reader.sequence()
+    print("%s: %d of %d frames (of up to %d samples) used, %d written in all"%(
+        reader.path, len(seqs), reader.nframes, reader.frame_samples, seqs.stop))
+    if len(seqs) > 0:
+        times = reader.index["time"][[seq % reader.nframes for seq in seqs]]
+        channels = np.unique(reader.index["channel"][[seq % reader.nframes for seq in seqs]])
+        print("From %s to %s, channels %s"%(time.ctime(np.min(times)), time.ctime(np.max(times)),
+                                            ", ".join(str(c) for c in channels)))
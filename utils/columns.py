@@ -0,0 +1,113 @@
+import datetime
+import sqlite3
+import numpy as np
+import pony.orm as pny
+
+from . import db
+
+#Low level access to the readings as numpy arrays.
+#
+# Going through pony creates a Reading object (with all its relationships) for every
+# row, which is slow and memory hungry when all we want are the times and values of a
+# day's readings. Instead these functions run the SQL directly and build contiguous
+# numpy arrays straight from the cursor:
+#    t - the times of the readings, as int64 microseconds since the epoch
+#    v - the values of the readings, as float64
+# (Note the dates in the database are local times, so t is too, i.e. it is the local
+# time as if it were UTC. Use to_datetime64 to convert it to datetime64s)
+
+#the rows returned by the query
+_dtype = np.dtype([("t", np.int64), ("v", np.float64)])
+
+#Pony stores dates as text ('YYYY-MM-DD HH:MM:SS', with '.ffffff' if there are any
+# microseconds), so we get sqlite to convert them to microseconds since the epoch. This is
+# exact: the whole seconds and the microseconds are converted separately, as integers
+# (julianday() would round them to the millisecond)
+_SELECT = ("SELECT CAST(strftime('%%s', substr(\"date\", 1, 19)) AS INTEGER)*1000000"
+           " + CAST(substr(\"date\" || '.000000', 21, 6) AS INTEGER), \"value\"%s "
+           'FROM "Reading" WHERE "variable" = ? AND "date" >= ? AND "date" < ? ORDER BY "date"')
+
+#dates far enough in the past/future to include every reading
+_EARLIEST = datetime.datetime(1,1,1)
+_LATEST = datetime.datetime(9999,12,31)
+
+
+#converts a datetime to the text format pony stores dates in
+def _sqldate(date):
+    return date.isoformat(" ")
+
+#converts times in microseconds since the epoch to a datetime64 array
+def to_datetime64(t):
+    return np.asarray(t, dtype=np.int64).astype("datetime64[us]")
+
+#converts a datetime to microseconds since the epoch
+def to_epoch(date):
+    return int(np.datetime64(date,"us").astype(np.int64))
+
+
+#Returns the times and values (t, v) of the readings of 'variable' taken in the
+# interval [start, end), sorted by time. If start or end are None the interval is
+# unbounded in that direction.
+# If metadata is True, the readings' metadata are also returned (t, v, metadata), as a list
+@pny.db_session
+def fetch_readings(variable, start=None, end=None, metadata=False):
+    if start is None:
+        start = _EARLIEST
+    if end is None:
+        end = _LATEST
+
+    #make sure any readings created in this db_session are in the database
+    pny.flush()
+
+    cursor = db.db.get_connection().cursor()
+    params = (variable, _sqldate(start), _sqldate(end))
+
+    if not metadata:
+        cursor.execute(_SELECT%"", params)
+        rows = np.fromiter(cursor, dtype=_dtype)
+        cursor.close()
+        return np.ascontiguousarray(rows["t"]), np.ascontiguousarray(rows["v"])
+
+    cursor.execute(_SELECT%', "metadata"', params)
+    rows = cursor.fetchall()
+    cursor.close()
+    t = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+    v = np.fromiter((row[1] for row in rows), dtype=np.float64, count=len(rows))
+    return t, v, [row[2] for row in rows]
+
+#Returns the readings of 'variable' on a day (see fetch_readings)
+def fetch_daily_readings(year, month, day, variable, metadata=False):
+    start = datetime.datetime(year=year, month=month, day=day)
+    return fetch_readings(variable, start, start + datetime.timedelta(days=1), metadata=metadata)
+
+
+#Yields the (date, value) of each reading of 'variable' in [start, end) (see fetch_readings),
+# sorted by time, with the dates as the text stored in the database.
+# Unlike fetch_readings, the readings are read from the cursor 'batchsize' rows at a time
+# as the generator is consumed, so memory use doesn't depend on the number of readings.
+# (e.g. for streaming them out of the website.) It uses its own connection rather than
+# pony's, so it can be used after the request's db_session has ended. Note the read
+# transaction lasts as long as the generator, so with the default (non WAL) sqlite profile
+# it blocks writers until it has finished.
+def iter_readings(variable, start=None, end=None, batchsize=1000):
+    if start is None:
+        start = _EARLIEST
+    if end is None:
+        end = _LATEST
+
+    connection = sqlite3.connect(db.dbfile)
+    try:
+        db.apply_pragmas(connection, db._pragmas)
+        connection.execute("PRAGMA query_only = ON")
+
+        cursor = connection.execute('SELECT "date", "value" FROM "Reading" '
+                                    'WHERE "variable" = ? AND "date" >= ? AND "date" < ? ORDER BY "date"',
+                                    (variable, _sqldate(start), _sqldate(end)))
+        while True:
+            rows = cursor.fetchmany(batchsize)
+            if len(rows) == 0:
+                break
+            for row in rows:
+                yield row
+    finally:
+        connection.close()
@@ -1,5 +1,6 @@
 import pony.orm as pny
 import datetime
+import collections
 
 db = pny.Database()
 
@@ -36,6 +37,7 @@ class Variable(db.Entity):
     monthly_statistics = pny.Set("Monthly_statistics")
     yearly_statistics = pny.Set("Yearly_statistics")
     LatestReading = pny.Set("LatestReading")
+    tiles = pny.Set("Tile")
 
 
 class Yearly_statistics(db.Entity):
@@ -52,10 +54,20 @@ class Yearly_statistics(db.Entity):
     total = pny.Optional(float)
     plot = pny.Optional(str)
 
+    #running accumulators for the statistics (see stats.py)
+    count = pny.Optional(int)
+    valsum = pny.Optional(float)
+    m2 = pny.Optional(float)
+    sketch = pny.Optional(str)
+
 class Monthly_statistics(db.Entity):
     month = pny.Required(Month)
     variable = pny.Required(Variable)
 
+    #the month as an integer, e.g. 202010, so we can look it up without going through Month
+    monthkey = pny.Optional(int)
+    pny.composite_index(variable, monthkey)
+
     yearly_statistics = pny.Required(Yearly_statistics)
 
     days = pny.Set("Daily_statistics")
@@ -68,10 +80,20 @@ class Monthly_statistics(db.Entity):
     total = pny.Optional(float)
     plot = pny.Optional(str)
 
+    #running accumulators for the statistics (see stats.py)
+    count = pny.Optional(int)
+    valsum = pny.Optional(float)
+    m2 = pny.Optional(float)
+    sketch = pny.Optional(str)
+
 class Daily_statistics(db.Entity):
     day = pny.Required(Day)
     variable = pny.Required(Variable)
 
+    #the day as an integer, e.g. 20201031, so we can look it up without going through Day and Month
+    daykey = pny.Optional(int)
+    pny.composite_index(variable, daykey)
+
     monthly_statistics = pny.Required(Monthly_statistics)
 
     readings=pny.Set("Reading")
@@ -83,6 +105,12 @@ class Daily_statistics(db.Entity):
     total = pny.Optional(float)
     plot = pny.Optional(str)
 
+    #running accumulators for the statistics (see stats.py)
+    count = pny.Optional(int)
+    valsum = pny.Optional(float)
+    m2 = pny.Optional(float)
+    sketch = pny.Optional(str)
+
 
 class Reading(db.Entity):
     date = pny.Required(datetime.datetime)
@@ -94,6 +122,12 @@ class Reading(db.Entity):
 
     latest = pny.Set("LatestReading")
 
+    #the day the reading was taken on as an integer, e.g. 20201031
+    daykey = pny.Optional(int, index=True)
+
+    #so looking up a variable's readings in a time range (or its latest reading) is an index search
+    pny.composite_index(variable, date)
+
 class LatestReading(db.Entity):
     variable = pny.PrimaryKey(Variable)
     reading = pny.Optional(Reading)
@@ -106,9 +140,84 @@ class LatestReading(db.Entity):
     total = pny.Optional(float)
 
 
+#A tile of the multi-resolution pyramid of readings (see tiles.py): the aggregate of a
+# variable's readings in the 'level' seconds starting at 'start' (ms since the epoch)
+class Tile(db.Entity):
+    variable = pny.Required(Variable)
+    level = pny.Required(int)
+    start = pny.Required(int, size=64)
+
+    count = pny.Required(int)
+    total = pny.Required(float)
+    minval = pny.Required(float)
+    maxval = pny.Required(float)
+
+    pny.composite_key(variable, level, start)
+
+#A counter that is incremented whenever data are written to the database, so readers (e.g.
+# the website's caches) can cheaply tell whether anything has changed. There is one row
+# (id 1), and it is only accessed through raw SQL (see logger.get_data_version)
+class DataVersion(db.Entity):
+    id = pny.PrimaryKey(int)
+    version = pny.Required(int, size=64)
+
+
+
+#Performance profiles for sqlite. Each is a set of pragmas applied to every connection
+# made to the database.
+#  default:     sqlite's defaults
+#  performance: Uses write-ahead logging (WAL), so the website can read the database while a
+#               logger is writing to it rather than getting "database is locked" errors, and
+#               syncs to disk less often (a power cut may lose the last few transactions, but
+#               can't corrupt the database). Connections wait up to busy_timeout ms for a lock
+#               rather than failing straight away, and use a larger page cache and memory mapped I/O.
+PROFILES = {
+    "default": {},
+    "performance": collections.OrderedDict([
+        ("busy_timeout", 5000),
+        ("journal_mode", "WAL"),
+        ("synchronous", "NORMAL"),
+        ("cache_size", -8000),
+        ("mmap_size", 64*1024*1024),
+    ]),
+}
+
+#the pragmas applied to new connections, and the database file (set by initialise_database)
+_pragmas = {}
+dbfile = None
+
+#Returns the pragmas for a profile. This is either the name of one of PROFILES,
+# or a dictionary of pragmas and their values
+def get_pragmas(profile):
+    if profile is None:
+        return {}
+    if isinstance(profile, dict):
+        return profile
+    if profile not in PROFILES:
+        raise ValueError("Unknown sqlite profile '%s'. Valid profiles are %s"%(profile,list(PROFILES)))
+    return PROFILES[profile]
+
+#applies pragmas to a sqlite (DB-API) connection
+def apply_pragmas(connection, pragmas):
+    cursor = connection.cursor()
+    for name, value in pragmas.items():
+        cursor.execute("PRAGMA %s = %s"%(name, value))
+    cursor.close()
+
+@db.on_connect(provider="sqlite")
+def _on_connect(db, connection):
+    apply_pragmas(connection, _pragmas)
+
+
+def initialise_database(file = "logs.sqlite", profile=None):
+    global _pragmas, dbfile
+    _pragmas = get_pragmas(profile)
+    dbfile = file
+
+    #bring an existing database file up to date with the schema above
+    from .migrate import upgrade_database
+    upgrade_database(file)
 
-
-def initialise_database(file = "logs.sqlite"):
     db.bind('sqlite', file, create_db=True)
     db.generate_mapping(create_tables=True)
 
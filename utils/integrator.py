@@ -0,0 +1,168 @@
+import time
+import datetime
+import collections
+
+#Integrating a sampled power into energy, for the power monitor.
+#
+# The power is measured in bursts (see power_monitor.py), which the Scheduler starts at
+# fixed intervals of the monotonic clock. Deadlines are absolute (start + k*interval), so
+# however long each burst and its processing take, the cadence doesn't drift, and if a
+# deadline is missed altogether we skip to the next one rather than bunching up.
+#
+# The EnergyIntegrator joins the power measurements with straight lines and integrates
+# them (the trapezoidal rule), splitting the energy into fixed periods (e.g. a minute)
+# whose boundaries are at fixed wall clock times (e.g. on the minute). Where a boundary
+# falls between two measurements, the power at the boundary is interpolated, so the
+# energy is split exactly and the periods' energies add up to the total. A period is
+# therefore only complete once the first measurement after its end has been added.
+#
+# All times are seconds on the monotonic clock (time.monotonic). Scheduler.to_datetime
+# converts them to wall clock times for logging. The Pi has no real time clock, so the wall
+# clock may be set (by NTP) after we start: Scheduler.sync_clock picks this up, and says
+# when the boundaries need re-aligning (see EnergyIntegrator.realign).
+
+
+#A completed period of the integration:
+# start, end - the start and end of the period (monotonic clock)
+# energy - the energy used in the period (J)
+# power - the mean power over the period (W)
+# error - the uncertainty on the energy (J), from the uncertainties of the measurements
+# duty - the fraction of the period spent measuring the power
+# samples - the number of measurements in the period
+Period = collections.namedtuple("Period", ["start", "end", "energy", "power", "error", "duty", "samples"])
+
+
+#the wall clock is taken to have been set if it moves this far (s) against the monotonic clock
+CLOCK_STEP = 1.
+
+
+#Calls to wait() return at start + k*interval on the monotonic clock, for k = 1, 2...
+# If align is True the deadlines fall on multiples of the interval of the wall clock
+# (e.g. every 5s on the 5s). clock and sleep can be replaced, e.g. to simulate time
+class Scheduler:
+    def __init__(self, interval, align=True, clock=time.monotonic, sleep=time.sleep, wallclock=time.time):
+        self.interval = interval
+        self.align = align
+        self.clock = clock
+        self.sleep = sleep
+        self.wallclock = wallclock
+
+        now = clock()
+        #the wall clock time at monotonic time 0 (see sync_clock)
+        self.offset = wallclock() - now
+        self.next = self.aligned(interval, now) if align else now
+        #the number of deadlines we have missed
+        self.missed = 0
+
+    #returns the first (monotonic) time after t that is a multiple of interval on the wall clock
+    def aligned(self, interval, t):
+        wall = t + self.offset
+        return (wall//interval + 1)*interval - self.offset
+
+    #waits for the next deadline, and returns it
+    def wait(self):
+        now = self.clock()
+        if now > self.next:
+            #we are late. Skip any deadlines we have missed entirely
+            missed = int((now - self.next)//self.interval)
+            self.missed += missed
+            self.next += missed*self.interval
+        else:
+            self.sleep(self.next - now)
+
+        deadline = self.next
+        self.next += self.interval
+        return deadline
+
+    #Re-reads the offset between the wall clock and the monotonic clock. This drifts a
+    # little as NTP adjusts the wall clock, but jumps if the clock is set (e.g. when the Pi
+    # gets the time after booting). If it has moved by more than CLOCK_STEP seconds, the
+    # deadlines are re-aligned to the wall clock, and True is returned, so anything else
+    # aligned to the wall clock (e.g. an EnergyIntegrator's periods) can be too
+    def sync_clock(self):
+        offset = self.wallclock() - self.clock()
+        stepped = abs(offset - self.offset) > CLOCK_STEP
+        self.offset = offset
+        if stepped and self.align:
+            self.next = self.aligned(self.interval, self.clock())
+        return stepped
+
+    #converts a monotonic time to a (local) datetime
+    def to_datetime(self, t):
+        return datetime.datetime.fromtimestamp(t + self.offset)
+
+
+#Integrates power measurements into the energy used in each period.
+# period is the length of the periods (s), and first_end is the end of the first period
+# (which starts at the first measurement)
+class EnergyIntegrator:
+    def __init__(self, period, first_end):
+        self.period = period
+        self.end = first_end
+
+        self.start = None
+        #the last measurement, as (time, power, error)
+        self.last = None
+        self._reset()
+
+    def _reset(self):
+        self.energy = 0.
+        self.error = 0.
+        self.measuring = 0.
+        self.samples = 0
+
+    #adds the trapezoid between (t0, p0, e0) and (t1, p1, e1) to the current period.
+    # The errors are treated as systematic (e.g. the resolution of the ADC), so are added linearly
+    def _integrate(self, t0, p0, e0, t1, p1, e1):
+        dt = t1 - t0
+        self.energy += 0.5*(p0 + p1)*dt
+        self.error += 0.5*(e0 + e1)*dt
+
+    #Adds a measurement of the power P (W), with uncertainty error (W), made at time t.
+    # duration is how long the measurement took (for the duty cycle).
+    # Returns a list of the Periods completed by this measurement (usually none)
+    def add(self, t, P, error=0., duration=0.):
+        completed = []
+
+        if self.last is None:
+            self.start = t
+            #if we start after the end of the first period, move it on
+            while self.end <= t:
+                self.end += self.period
+        else:
+            t0, p0, e0 = self.last
+            if t <= t0:
+                raise ValueError("Measurements must be added in time order")
+
+            #close any periods that end before this measurement
+            while self.end <= t:
+                f = (self.end - t0)/(t - t0)
+                pb = p0 + f*(P - p0)
+                eb = e0 + f*(error - e0)
+                self._integrate(t0, p0, e0, self.end, pb, eb)
+                completed.append(self._close())
+                t0, p0, e0 = self.end, pb, eb
+                self.end += self.period
+
+            self._integrate(t0, p0, e0, t, P, error)
+
+        self.last = (t, P, error)
+        self.measuring += duration
+        self.samples += 1
+        return completed
+
+    #Moves the end of the current period to 'end' (e.g. to re-align it to the wall clock
+    # after that has been set). This must be after the last measurement
+    def realign(self, end):
+        if self.last is not None and end <= self.last[0]:
+            raise ValueError("The period can't end before the last measurement")
+        self.end = end
+
+    #finishes the current period, returning it, and starts the next
+    def _close(self):
+        length = self.end - self.start
+        period = Period(start=self.start, end=self.end, energy=self.energy, power=self.energy/length,
+                        error=self.error, duty=min(self.measuring/length, 1.), samples=self.samples)
+        self.start = self.end
+        self._reset()
+        return period
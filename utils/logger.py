@@ -8,8 +8,17 @@ import matplotlib.dates as mdates
 from calendar import monthrange
 import json
 import os
+import atexit
+import functools
+import threading
+import collections
 
 from utils import GetConfig
+from .stats import Accumulator
+from .renderer import PlotRenderer, save_figure
+from .binning import bin_totals, HOUR
+from .columns import fetch_readings, fetch_daily_readings, to_datetime64
+from .tiles import update_tiles
 
 plt.switch_backend('Agg')
 
@@ -20,11 +29,54 @@ dbdir = dbconfig["dbdir"]
 dbname = dbconfig["dbname"]
 plotdir = dbconfig["plotdir"]
 
+#whether plots are rendered as their statistics are generated. If not, they are only
+# rendered when they are requested (e.g. by the website)
+prerender_plots = dbconfig.get("prerender_plots",False)
+
+#plots are rendered in the background, each at most once every plot_interval seconds
+renderer = PlotRenderer(interval=dbconfig.get("plot_interval",60),
+                        background=dbconfig.get("background_plots",True))
+
+#render any outstanding plots before we exit
+atexit.register(renderer.flush)
+
+#Plots requested while generating statistics are only handed to the renderer once the
+# (outermost) db_session that generated them has finished. Otherwise the renderer could
+# read the database before the new statistics have been committed.
+_plot_requests = threading.local()
+
+#decorator for functions that request plots (apply it outside the db_session decorator)
+def _renders_plots(func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        depth = getattr(_plot_requests, "depth", 0)
+        if depth == 0:
+            _plot_requests.pending = []
+        _plot_requests.depth = depth + 1
+        try:
+            result = func(*args, **kwargs)
+        finally:
+            _plot_requests.depth = depth
+
+        #we're back out of the outermost call, so the db_session has been committed
+        if depth == 0:
+            pending = _plot_requests.pending
+            _plot_requests.pending = []
+            for fname, plotfunc, plotargs in pending:
+                renderer.request(fname, plotfunc, *plotargs)
+        return result
+    return wrapper
+
+#requests that the plot fname is (re)rendered by plotfunc(*args, fname)
+def _request_plot(fname, plotfunc, *args):
+    if prerender_plots:
+        _plot_requests.pending.append((fname, plotfunc, args))
+
 
 
 def init(dbfile = os.path.join(dbdir,dbname)):
     print("Opening database '%s'"%dbfile)
-    db.initialise_database(dbfile)
+    db.initialise_database(dbfile, profile=dbconfig.get("sqlite_profile"))
 
 
 #Registers a variable. 
@@ -52,45 +104,173 @@ def register_variable(name, unit, description, min=None, max=None, cumulative =
     if latest is None:
         latest = db.LatestReading(variable=var)
 
+    _bump_data_version()
+
 
 #registers a reading with the database
-@pny.db_session
 def register_reading(variable, value, date=None, metadata="",recompute_statistics=True):
-    
-    #get info on the variable from the database
-    Variable = db.Variable.get(name=variable)
-    if Variable is None:
-        raise Exception("Unknown variable %s"%variable)
-    
-    #unless the date is specified, we assume the reading was taken now
-    if date == None:
-        date = datetime.datetime.now()
+    register_readings([(variable, value, date, metadata)], recompute_statistics=recompute_statistics)
 
-    year = date.year
-    month = date.month
-    day = date.day
-    
-    #create the day in the database if it does not already exist
-    # (This will also recursively create the month and year if need be)
-    Day = _register_day(year,month,day)
-    
-    #register the daily stats table for this variable on this day (if it does not exist)
-    daily_stats = _register_daily_stats(day=Day, variable=Variable)
-    
-    #now create the database entry for this reading
-    print("Registering reading of %s = %f at %s"%(Variable.name,value,date))
-    reading = db.Reading(date = date, variable=Variable, value = value, daily_statistics=daily_stats,metadata=metadata)
+
+#registers a batch of readings with the database in one transaction
+# batch is an iterable of (variable, value, date, metadata) tuples. date and metadata
+# can be left out (or be None), in which case they default to now and "".
+# The day/month/year and daily stats tables are only looked up once per distinct day,
+# and the statistics are regenerated once per affected day, month and year (rather
+# than once per reading)
+@_renders_plots
+@pny.db_session
+def register_readings(batch, recompute_statistics=True):
+
+    now = datetime.datetime.now()
+
+    #cache the things we look up from the database so we only do this once per batch
+    Variables = {}
+    daily_stats = {}
+    accumulators = {}
+    tiles = []
+
+    #the (year, month, day, variable) buckets that have had new readings added
+    dirty = set()
+
+    count = 0
+    for entry in batch:
+        variable, value, date, metadata = _unpack_reading(entry, now)
+
+        #get info on the variable from the database
+        Variable = Variables.get(variable)
+        if Variable is None:
+            Variable = db.Variable.get(name=variable)
+            if Variable is None:
+                raise Exception("Unknown variable %s"%variable)
+            Variables[variable] = Variable
+
+        key = (date.year, date.month, date.day, variable)
+        daykey = _day_key(date.year, date.month, date.day)
+
+        #get the daily stats table for this variable on this day, registering it if it does not exist
+        # (This will also recursively create the day, month and year if need be)
+        stats = daily_stats.get(key)
+        if stats is None:
+            stats = db.Daily_statistics.get(variable=Variable, daykey=daykey)
+            if stats is None:
+                Day = _register_day(date.year, date.month, date.day)
+                stats = _register_daily_stats(day=Day, variable=Variable)
+            daily_stats[key] = stats
+            accumulators[key] = _get_accumulator(stats)
+
+        #now create the database entry for this reading
+        db.Reading(date = date, variable=Variable, value = value, daily_statistics=stats, metadata=metadata, daykey=daykey)
+
+        #and add it to the running statistics for the day
+        accumulators[key].add(value)
+        tiles.append((Variable, date, value))
+
+        dirty.add(key)
+        count += 1
+
+    for key in accumulators:
+        accumulators[key].store(daily_stats[key])
+
+    update_tiles(tiles)
+    _bump_data_version()
+
+    print("Registered %d reading(s) across %d day(s)"%(count, len(dirty)))
 
     #update the statistics (unless we opted not to)
     if recompute_statistics:
-        generate_daily_statistics(year,month,day,variable)
-        generate_monthly_statistics(year,month,variable)
-        generate_yearly_statistics(year,variable)
+        _regenerate_statistics(dirty)
+
+
+#splits a batch entry up into its (variable, value, date, metadata), filling in any defaults
+def _unpack_reading(entry, now):
+    variable = entry[0]
+    value = entry[1]
+    date = entry[2] if len(entry) > 2 else None
+    metadata = entry[3] if len(entry) > 3 else None
+
+    #unless the date is specified, we assume the reading was taken now
+    if date is None:
+        date = now
+    if metadata is None:
+        metadata = ""
+
+    return variable, value, date, metadata
+
+
+#regenerates the statistics for a set of (year, month, day, variable) buckets.
+# Each day, month and year (and the latest stats for each variable) is only regenerated once
+@pny.db_session
+def _regenerate_statistics(buckets):
+    months = set((y, m, v) for (y, m, d, v) in buckets)
+    years = set((y, v) for (y, m, d, v) in buckets)
+    variables = set(v for (y, m, d, v) in buckets)
+
+    for (year, month, day, variable) in sorted(buckets):
+        generate_daily_statistics(year, month, day, variable, recompute=False)
 
+    for (year, month, variable) in sorted(months):
+        generate_monthly_statistics(year, month, variable)
+
+    for (year, variable) in sorted(years):
+        generate_yearly_statistics(year, variable)
+
+    for variable in sorted(variables):
         generate_latest_stats(variable)
 
 
 
+#Returns the running statistics accumulator for a daily/monthly/yearly statistics table.
+# Tables from before accumulators were introduced have theirs rebuilt (and stored)
+def _get_accumulator(stats):
+    acc = Accumulator.load(stats)
+    if acc is None:
+        acc = _rebuild_accumulator(stats)
+        acc.store(stats)
+    return acc
+
+#Rebuilds the running statistics accumulator for a statistics table.
+# Days are rebuilt from their readings, months by merging their days' accumulators
+# and years by merging their months'
+def _rebuild_accumulator(stats):
+    if isinstance(stats, db.Daily_statistics):
+        day = stats.day
+        t, v = fetch_daily_readings(day.month.year.year, day.month.month, day.day, stats.variable.name)
+        acc = Accumulator()
+        acc.add_many(v)
+    elif isinstance(stats, db.Monthly_statistics):
+        acc = Accumulator.merged(_get_accumulator(day) for day in stats.days)
+    else:
+        acc = Accumulator.merged(_get_accumulator(month) for month in stats.months)
+    return acc
+
+#Sets the statistics in a statistics table from its accumulator
+def _set_statistics(stats, acc, cumulative):
+    if not cumulative:
+        stats.mean = acc.mean()
+        stats.median = acc.median()
+        stats.stddev = acc.stddev()
+    else:
+        stats.total = acc.valsum
+
+
+#Helpers to return the integer keys used to look up days and months, e.g. 20201031 and 202010
+def _day_key(year,month,day):
+    return year*10000 + month*100 + day
+
+def _month_key(year,month):
+    return year*100 + month
+
+#Helper to return the daily stats object for a variable on a day
+@pny.db_session
+def _get_daily_stats(year,month,day,variable):
+    return db.Daily_statistics.get(variable=variable, daykey=_day_key(year,month,day))
+
+#Helper to return the monthly stats object for a variable in a month
+@pny.db_session
+def _get_monthly_stats(year,month,variable):
+    return db.Monthly_statistics.get(variable=variable, monthkey=_month_key(year,month))
+
 #Helper to return a year object
 @pny.db_session
 def _get_year(year):
@@ -159,7 +339,8 @@ def _register_monthly_stats(month, variable):
     if monthly_stats is None:
         yearly_stats = _register_yearly_stats(year=month.year,variable=variable)
         print("Registering monthly stats for %s for %d-%d"%(variable.name,month.year.year, month.month))
-        monthly_stats=db.Monthly_statistics(month=month, variable = variable, yearly_statistics=yearly_stats)
+        monthly_stats=db.Monthly_statistics(month=month, variable = variable, yearly_statistics=yearly_stats,
+                                            monthkey=_month_key(month.year.year, month.month))
     return monthly_stats
 
 #Registers daily stats with the database (if it does not already exist) and returns its object
@@ -169,12 +350,14 @@ def _register_daily_stats(day,variable):
     if daily_stats is None:
         monthly_stats = _register_monthly_stats(day.month,variable)
         print('Registering daily stats for %s on %d-%d-%d'%(variable.name,day.month.year.year,day.month.month,day.day))
-        daily_stats = db.Daily_statistics(day=day,variable=variable, monthly_statistics=monthly_stats)
+        daily_stats = db.Daily_statistics(day=day,variable=variable, monthly_statistics=monthly_stats,
+                                          daykey=_day_key(day.month.year.year, day.month.month, day.day))
     return daily_stats
 
 
-#Generates statistics and plots for the last 24h of data
+#Generates statistics for the last 24h of data (and requests its plot)
 #This is automatically called for a variable when it has a new reaading registered
+@_renders_plots
 @pny.db_session
 def generate_latest_stats(variable=None):
 
@@ -199,15 +382,7 @@ def generate_latest_stats(variable=None):
         Latest.reading = r
 
         #get last 24h of readings
-        readings = db.Reading.select(lambda r: r.variable == var and r.date > oneDayAgo).order_by(lambda r: r.date)
-
-        #put those readings into lists (arrays) for plotting and calculating statistics
-        t=[]
-        v=[]
-        for r in readings:
-            t.append(r.date)
-            v.append(r.value)
-        v=np.asarray(v)
+        t, v = fetch_readings(var.name, oneDayAgo)
 
         if len(v) > 0:
             if not cumulative:
@@ -227,79 +402,94 @@ def generate_latest_stats(variable=None):
             Latest.stddev=None
             Latest.total = None
 
-        
+        fname = os.path.join(plotdir,"Latest_%s.png"%(var.name))
+        _request_plot(fname, plot_latest, var.name)
+    
+        Latest.plot=fname
+
 
-        #plot the values over the day
-        print("Generating latest plot for %s"%var.name)
+#Plots the last 24h of data for a variable, saving the plot to fname
+@pny.db_session
+def plot_latest(variable, fname):
+    print("Generating latest plot for %s"%variable)
 
-        fig, ax = plt.subplots()
-        myFmt = mdates.DateFormatter('%H:%M\n%d/%m')
-        ax.xaxis.set_major_formatter(myFmt)
+    var = db.Variable.get(name=variable)
+    cumulative = var.cumulative
 
-        if not cumulative:
-            
-            plt.plot(t,v)
+    oneDayAgo = datetime.datetime.now() - datetime.timedelta(days=1)
+
+    #get last 24h of readings
+    t, v = fetch_readings(variable, oneDayAgo)
+    t = to_datetime64(t)
+
+    #plot the values over the day
+    fig, ax = plt.subplots()
+    myFmt = mdates.DateFormatter('%H:%M\n%d/%m')
+    ax.xaxis.set_major_formatter(myFmt)
+
+    if not cumulative:
+        
+        plt.plot(t,v)
+        
+    else:
+        #total the values for each hour
+        hours, vals = bin_totals(t, v, oneDayAgo, HOUR, 24)
+        plt.bar(hours,vals,width=1./24)
             
-        else:
-            hours = [oneDayAgo+datetime.timedelta(hours=j,minutes=30) for j in range(24)]
-            vals = np.zeros((24))
-            for i in range(len(v)):
-                dt = (t[i]-oneDayAgo).seconds//3600
-                vals[dt] += v[i]
-            plt.bar(hours,vals,width=1./24)
-                
-        plt.title("Latest %s"%(var.name))
-
-        plt.ylabel("%s (%s)"%(var.name,var.unit))
-        plt.ylim(var.minval,var.maxval)
-        plt.xlim(oneDayAgo,datetime.datetime.now())
-
-
-       
-        #save the plot to file 
-        fname = os.path.join(plotdir,"Latest_%s.png"%(var.name))
+    plt.title("Latest %s"%(var.name))
 
-        plt.savefig(fname)
-        plt.close()
-    
-        Latest.plot=fname
+    plt.ylabel("%s (%s)"%(var.name,var.unit))
+    plt.ylim(var.minval,var.maxval)
+    plt.xlim(oneDayAgo,datetime.datetime.now())
 
+    #save the plot to file 
+    save_figure(fname)
 
 
-#Generates daily statistics (and a plot for that day)
-#This is automatically called for a variable when it has a new reaading registered
+
+#Generates daily statistics (and requests a plot for that day)
+#This is automatically called for a variable when it has a new reaading registered.
+# The statistics are kept up to date by running accumulators as readings come in,
+# so unless recompute is True they are not recalculated from the readings
+@_renders_plots
 @pny.db_session
-def generate_daily_statistics(year,month,day,variable):
+def generate_daily_statistics(year,month,day,variable,recompute=True):
     print('Generating Daily statistics for %s for %d-%02d-%02d'%(variable,year,month,day))
 
     #get the required things from the database
     Variable = db.Variable.get(name=variable)
-    Day = _get_day(year,month,day)
-    stats = db.Daily_statistics.get(day=Day,variable=variable)
+    stats = _get_daily_stats(year,month,day,variable)
 
     cumulative = Variable.cumulative
-    
-    #extract the readings for that day from the statistics
-    readings = stats.readings.order_by(lambda r: r.date)
-
-    #put the values and times of the readings into arrays
-    vals = []
-    t = []
-    for reading in readings:
-        vals.append(reading.value)
-        t.append(reading.date)
 
-    vals=np.asarray(vals)
-    
     #calculate the statistics
-    if not cumulative:
-        stats.mean = np.mean(vals)
-        stats.median = np.median(vals)
-        stats.minval = np.min(vals)
-        stats.maxval = np.max(vals)
-        stats.stddev = np.std(vals)
+    if recompute:
+        acc = _rebuild_accumulator(stats)
     else:
-        stats.total = np.sum(vals)
+        acc = _get_accumulator(stats)
+    acc.store(stats)
+    _set_statistics(stats, acc, cumulative)
+
+    fname = os.path.join(plotdir,"Daily_%s_%04d-%02d-%02d.png"%(variable,year,month,day))
+    _request_plot(fname, plot_daily, year, month, day, variable)
+
+    stats.plot=fname
+
+
+#Plots the readings of a variable over a day, saving the plot to fname
+@pny.db_session
+def plot_daily(year,month,day,variable,fname):
+    print('Generating Daily plot for %s for %d-%02d-%02d'%(variable,year,month,day))
+
+    Variable = db.Variable.get(name=variable)
+
+    cumulative = Variable.cumulative
+    
+    #get the readings for that day
+    t, vals = fetch_daily_readings(year,month,day,variable)
+    t = to_datetime64(t)
+
+    t0 = datetime.datetime.combine(datetime.date(day=day,month=month,year=year),datetime.time.min)
     
     #plot the values over the day
     fig, ax = plt.subplots()
@@ -308,13 +498,8 @@ def generate_daily_statistics(year,month,day,variable):
     if not cumulative:
         plt.plot(t,vals)
     else:
-        t0 = datetime.datetime.combine(datetime.date(day=day,month=month,year=year),datetime.time.min)
-        hours = [t0+datetime.timedelta(hours=j,minutes=30) for j in range(24)]
-        totals = np.zeros((24))
-
-        for i in range(len(vals)):
-            h = t[i].hour
-            totals[h] += vals[i]
+        #total the values for each hour of the day
+        hours, totals = bin_totals(t, vals, t0, HOUR, 24)
            
         plt.bar(hours,totals,width=(1./24))
 
@@ -322,27 +507,45 @@ def generate_daily_statistics(year,month,day,variable):
     plt.xlabel("Time")
     plt.ylabel("%s (%s)"%(Variable.name,Variable.unit))
     plt.ylim(Variable.minval,Variable.maxval)
-    tmin = datetime.datetime.combine(t[0].date(),datetime.time.min)
-    tmax = datetime.datetime.combine(t[0].date()+datetime.timedelta(days=1),datetime.time.min)
-    plt.xlim(tmin,tmax)
+    plt.xlim(t0,t0+datetime.timedelta(days=1))
     
     #save the plot to file 
-    fname = os.path.join(plotdir,"Daily_%s_%04d-%02d-%02d.png"%(variable,year,month,day))
-    plt.savefig(fname)
-    plt.close()
+    save_figure(fname)
 
-    stats.plot=fname
 
-#generates monthly statistics (and a plot for that month) 
+#generates monthly statistics (and requests a plot for that month) 
 # This is automatically called for a variable when it has a new reaading registered     
+@_renders_plots
 @pny.db_session
 def generate_monthly_statistics(year,month,variable):
     print('Generating monthly statistics for %s for %d-%02d'%(variable,year,month))
 
     #get the things we need from the db
     Variable = db.Variable.get(name=variable)
-    Month = _get_month(year,month)
-    stats = db.Monthly_statistics.get(month=Month,variable=variable)
+    stats = _get_monthly_stats(year,month,variable)
+
+    cumulative = Variable.cumulative
+
+    #calculate the statistics for the month by merging those of its days
+    # (this doesn't need to touch the readings, and gives the same result as
+    # calculating them over every reading in the month)
+    acc = _rebuild_accumulator(stats)
+    acc.store(stats)
+    _set_statistics(stats, acc, cumulative)
+
+    fname = os.path.join(plotdir,"Monthly_%s_%04d-%02d.png"%(variable,year,month))
+    _request_plot(fname, plot_monthly, year, month, variable)
+
+    stats.plot=fname
+
+
+#Plots the daily statistics of a variable over a month, saving the plot to fname
+@pny.db_session
+def plot_monthly(year,month,variable,fname):
+    print('Generating monthly plot for %s for %d-%02d'%(variable,year,month))
+
+    Variable = db.Variable.get(name=variable)
+    stats = _get_monthly_stats(year,month,variable)
 
     cumulative = Variable.cumulative
     
@@ -372,13 +575,6 @@ def generate_monthly_statistics(year,month,variable):
         maxval = np.asarray(maxval)
         median = np.asarray(median)
         std = np.asarray(std)
-        
-        #calculate some statistics for the month
-        stats.mean = np.mean(vals)
-        stats.median = np.median(vals)
-        stats.minval = np.min(minval)
-        stats.maxval = np.max(maxval)
-        stats.stddev = np.std(vals)
 
         #plot the month's data
         plt.plot(t,vals,color="black")
@@ -393,8 +589,6 @@ def generate_monthly_statistics(year,month,variable):
         for day in days:
             totals.append(day.total)
             t.append(day.day.day+0.5)
-
-        stats.total = sum(totals)
             
         plt.bar(t,totals,width=1)
 
@@ -407,15 +601,12 @@ def generate_monthly_statistics(year,month,variable):
 
     
     #save the plot to file
-    fname = os.path.join(plotdir,"Monthly_%s_%04d-%02d.png"%(variable,year,month))
-    plt.savefig(fname)
-    plt.close()
-
-    stats.plot=fname
+    save_figure(fname)
    
     
-#generates yearly statistics (and a plot for that year)
+#generates yearly statistics (and requests a plot for that year)
 #This is automatically called for a variable when it has a new reaading registered
+@_renders_plots
 @pny.db_session
 def generate_yearly_statistics(year,variable):
     print('Generating yearly statistics for %s for %d'%(variable,year))
@@ -425,6 +616,28 @@ def generate_yearly_statistics(year,variable):
     Year = _get_year(year)
     stats = db.Yearly_statistics.get(year=Year,variable=variable)
 
+    cumulative = Variable.cumulative
+
+    #calculate the statistics for the year by merging those of its months
+    acc = _rebuild_accumulator(stats)
+    acc.store(stats)
+    _set_statistics(stats, acc, cumulative)
+
+    fname = os.path.join(plotdir,"Yearly_%s_%04d.png"%(variable,year))
+    _request_plot(fname, plot_yearly, year, variable)
+
+    stats.plot=fname
+
+
+#Plots the monthly statistics of a variable over a year, saving the plot to fname
+@pny.db_session
+def plot_yearly(year,variable,fname):
+    print('Generating yearly plot for %s for %d'%(variable,year))
+
+    Variable = db.Variable.get(name=variable)
+    Year = _get_year(year)
+    stats = db.Yearly_statistics.get(year=Year,variable=variable)
+
     cumulative = Variable.cumulative
     
     #get the monthly statistics for each month in the year
@@ -453,13 +666,6 @@ def generate_yearly_statistics(year,variable):
         maxval = np.asarray(maxval)
         median = np.asarray(median)
         std = np.asarray(std)
-        
-        #calculate the statistics for the year
-        stats.mean = np.mean(vals)
-        stats.median = np.median(vals)
-        stats.minval = np.min(minval)
-        stats.maxval = np.max(maxval)
-        stats.stddev = np.std(vals)
 
         #plot he yearly statistics
         plt.plot(t,vals,color="black")
@@ -473,8 +679,6 @@ def generate_yearly_statistics(year,variable):
             t.append(month.month.month+0.5)
             totals.append(month.total)
 
-        stats.total = sum(totals)
-
         plt.bar(t,totals,width=1)
    
     plt.title("%4d"%year)
@@ -488,17 +692,16 @@ def generate_yearly_statistics(year,variable):
     
     
     #save the plot to file
-    fname = os.path.join(plotdir,"Yearly_%s_%04d.png"%(variable,year))
-    plt.savefig(fname)
-    plt.close()
-
-    stats.plot=fname
+    save_figure(fname)
 
 
 #(re)generate all the statistics in the db for all variables
+@_renders_plots
 @pny.db_session
 def generate_all_statistics(yearly=True,monthly=True, daily=True):
 
+    _bump_data_version()
+
     variables = pny.select(v for v in db.Variable)
     
     if daily:
@@ -532,32 +735,27 @@ def generate_all_statistics(yearly=True,monthly=True, daily=True):
 #Get the readings for a day, return as a list of dicts
 @pny.db_session
 def get_daily_readings(year,month,day,variable):
-    Day = _get_day(year,month,day)
-
-    if Day is None:
-        return []
+    t, v, metadata = fetch_daily_readings(year,month,day,variable,metadata=True)
 
-    stats = db.Daily_statistics.get(variable=variable, day=Day)
+    timestamps = to_datetime64(t).astype(datetime.datetime)
 
     data=[]
-    for reading in stats.readings.order_by(lambda r: r.date):
+    for i in range(len(v)):
         d={}
-        d["timestamp"] = reading.date
-        d["value"] = reading.value
-        d["metadata"] = json.loads(reading.metadata)
+        d["timestamp"] = timestamps[i]
+        d["value"] = float(v[i])
+        d["metadata"] = json.loads(metadata[i])
         data.append(d)
     return data
 
 #returns the daily statistics as a dictionary
 @pny.db_session
 def get_daily_stats(year,month,day,variable):
-    Day = _get_day(year,month,day)
+    stats = _get_daily_stats(year,month,day,variable)
 
-    if Day is None:
+    if stats is None:
         return {}
 
-    stats = db.Daily_statistics.get(variable=variable, day=Day)
-
     data = {
         "mean": stats.mean,
         "median": stats.median,
@@ -566,20 +764,18 @@ def get_daily_stats(year,month,day,variable):
         "stddev": stats.stddev,
         "total": stats.total,
         "plot": stats.plot,
-        "num_readings": len(stats.readings)
+        "num_readings": stats.count if stats.count is not None else stats.readings.count()
     }
     return data
 
 #returns the monthly statistics as a dictionary
 @pny.db_session
 def get_monthly_stats(year,month,variable):
-    Month = _get_month(year,month)
+    stats = _get_monthly_stats(year,month,variable)
 
-    if Month is None:
+    if stats is None:
         return {}
 
-    stats = db.Monthly_statistics.get(variable=variable, month=Month)
-
     data = {
         "mean": stats.mean,
         "median": stats.median,
@@ -612,6 +808,39 @@ def get_yearly_stats(year,variable):
     }
     return data
 
+#Returns a summary of the data the plot of a variable for a period is drawn from (or None
+# if there is no data for it). This changes whenever the plot would, so can be used as a
+# key when caching plots.
+# The period is given by year, month and day. If year is None it is the latest 24h
+@pny.db_session
+def get_plot_state(variable, year=None, month=None, day=None):
+    Variable = db.Variable.get(name=variable)
+    if Variable is None:
+        return None
+
+    state = (Variable.unit, Variable.minval, Variable.maxval, Variable.cumulative)
+
+    #latest plot. This changes with every new reading
+    if year is None:
+        latest = db.LatestReading.get(variable=Variable)
+        if latest is None or latest.reading is None:
+            return None
+        return state + (latest.reading.date, latest.mean, latest.total)
+
+    if month is None:
+        Year = _get_year(year)
+        stats = db.Yearly_statistics.get(year=Year, variable=Variable) if Year is not None else None
+    elif day is None:
+        stats = _get_monthly_stats(year,month,variable)
+    else:
+        stats = _get_daily_stats(year,month,day,variable)
+
+    if stats is None:
+        return None
+
+    #the accumulators change whenever a reading is added to the period
+    return state + (stats.count, stats.valsum, stats.m2, stats.minval, stats.maxval)
+
 #returns the latest readings as a list of dictionaries
 @pny.db_session
 def get_latest_readings():
@@ -641,12 +870,11 @@ def get_latest_readings():
 
 @pny.db_session
 def get_all_stats_for_day(year,month,day):
-    Day = _get_day(year,month,day)
+    daykey = _day_key(year,month,day)
+    Stats = db.Daily_statistics.select(lambda s: s.daykey == daykey).order_by(lambda s: s.variable)[:]
 
-    if Day is None:
+    if len(Stats) == 0:
         return None
-
-    Stats = Day.statistics.order_by(lambda s: s.variable)
     
     daily = []
     for stat in Stats:
@@ -667,12 +895,11 @@ def get_all_stats_for_day(year,month,day):
 
 @pny.db_session
 def get_all_stats_for_month(year,month):
-    Month = _get_month(year,month)
+    monthkey = _month_key(year,month)
+    Stats = db.Monthly_statistics.select(lambda s: s.monthkey == monthkey).order_by(lambda s: s.variable)[:]
 
-    if Month is None:
+    if len(Stats) == 0:
         return None
-    
-    Stats = Month.statistics.order_by(lambda s: s.variable)
 
     Monthly = []
     for stat in Stats:
@@ -717,49 +944,39 @@ def get_all_stats_for_year(year):
     
     return Yearly
 
-#returns a list of the years in the database (as integers, e.g. [2019,2020])
+#Returns the days with data and how many readings (of all variables) were taken on each,
+# as an ordered dictionary {(year, month, day): count}. If year (and month) are given
+# only days in that year (month) are returned.
+# This is one query on the daily statistics (rather than walking Year -> Month -> Day).
+# (Days whose statistics predate the accumulators have a count of 0 until they are next updated)
 @pny.db_session
-def get_years():
-    Y = db.Year.select().order_by(db.Year.year)
-    years=[]
-    
-    if Y is not None:
-        for y in Y:
-            years.append(y.year)
-    return years
-
-#returns a list of the months available in the specified year as integers (e.g. [1,2,3,4,11,12])
-@pny.db_session
-def get_months(year):
-    y = _get_year(year)
-    if y is None:
-        return []
+def get_day_counts(year=None, month=None):
+    if year is None:
+        first, last = 0, 99999999
+    elif month is None:
+        first, last = _day_key(year,1,1), _day_key(year,12,31)
+    else:
+        first, last = _day_key(year,month,1), _day_key(year,month,31)
 
-    Months = y.months.order_by(db.Month.month)
+    rows = db.db.select('SELECT "daykey", SUM(COALESCE("count", 0)) FROM "Daily_statistics" '
+                        'WHERE "daykey" BETWEEN $first AND $last GROUP BY "daykey" ORDER BY "daykey"')
 
-    months = []
+    counts = collections.OrderedDict()
+    for daykey, count in rows:
+        counts[(daykey//10000, (daykey//100)%100, daykey%100)] = count
+    return counts
 
-    for month in Months:
-        months.append(month.month)
+#returns a list of the years in the database (as integers, e.g. [2019,2020])
+def get_years():
+    return sorted(set(y for (y, m, d) in get_day_counts()))
 
-    return months
+#returns a list of the months available in the specified year as integers (e.g. [1,2,3,4,11,12])
+def get_months(year):
+    return sorted(set(m for (y, m, d) in get_day_counts(year)))
 
 #returns a list of the days belonging to the speficied month as integers (e.g. [1,2,3,4,29,30])
-@pny.db_session
 def get_days(year,month):
-    m = _get_month(year,month)
-
-    if m is None:
-        return []
-    
-    Days = m.days.order_by(db.Day.day)
-    
-    days=[]
-
-    for day in Days:
-        days.append(day.day)
-
-    return days
+    return [d for (y, m, d) in get_day_counts(year,month)]
 
 #returns info on the variables in the database
 @pny.db_session
@@ -787,6 +1004,39 @@ def get_variables():
 def get_reading_count(format=False):
     return db.Reading.select().count()
 
+#Increments the data version (see db.DataVersion). Call it inside the db_session that
+# writes the data. This is a single UPDATE, so writers in different processes can't
+# lose each other's increments
+def _bump_data_version():
+    db.db.execute('INSERT OR IGNORE INTO "DataVersion" ("id", "version") VALUES (1, 0)')
+    db.db.execute('UPDATE "DataVersion" SET "version" = "version" + 1 WHERE "id" = 1')
+
+#returns the data version, which changes whenever data are written to the database
+@pny.db_session
+def get_data_version():
+    versions = db.db.select('SELECT "version" FROM "DataVersion" WHERE "id" = 1')
+    return versions[0] if len(versions) > 0 else 0
+
+#returns the names of the variables in the database (sorted)
+@pny.db_session
+def get_variable_names():
+    return sorted(pny.select(v.name for v in db.Variable))
+
+#returns the date of the most recent reading of any variable (or None if there are none).
+# If start and end are given, it is the most recent reading in [start, end)
+@pny.db_session
+def get_latest_reading_date(start=None, end=None):
+    if start is None:
+        return pny.max(l.reading.date for l in db.LatestReading if l.reading is not None)
+
+    #one query per variable, so each is a single lookup in the (variable, date) index
+    latest = None
+    for Variable in db.Variable.select():
+        date = pny.max(r.date for r in db.Reading if r.variable == Variable and r.date >= start and r.date < end)
+        if date is not None and (latest is None or date > latest):
+            latest = date
+    return latest
+
 
 if __name__ == "__main__":
 
@@ -1,7 +1,91 @@
-import logger
 import datetime
 import json
 import os
+import sys
+import sqlite3
+
+
+#Upgrades to the schema of existing databases.
+# The schema in db.py is only used by pony to create tables that don't exist yet, so
+# when it changes, any existing database files need to be brought up to date. Each
+# function in UPGRADES performs one of these steps, and sqlite's 'user_version' pragma
+# records how many of them have been applied to a database file.
+
+#returns the names of the columns in a table (an empty list if the table doesn't exist)
+def _get_columns(connection, table):
+    return [row[1] for row in connection.execute('PRAGMA table_info("%s")'%table)]
+
+#adds any of the columns in 'columns' (a list of (name, type) tuples) missing from 'table'
+def _add_columns(connection, table, columns):
+    existing = _get_columns(connection, table)
+    #the table doesn't exist yet. Pony will create it (with the new columns)
+    if len(existing) == 0:
+        return
+    for name, type in columns:
+        if name not in existing:
+            print("Adding column '%s' to table '%s'"%(name,table))
+            connection.execute('ALTER TABLE "%s" ADD COLUMN "%s" %s'%(table,name,type))
+
+ACCUMULATOR_COLUMNS = [("count", "INTEGER"),
+                       ("valsum", "REAL"),
+                       ("m2", "REAL"),
+                       ("sketch", "TEXT NOT NULL DEFAULT ''")]
+
+#1: running statistics accumulators on the daily statistics
+def _upgrade_accumulators(connection):
+    _add_columns(connection, "Daily_statistics", ACCUMULATOR_COLUMNS)
+
+#2: running statistics accumulators on the monthly and yearly statistics
+def _upgrade_rollup_accumulators(connection):
+    _add_columns(connection, "Monthly_statistics", ACCUMULATOR_COLUMNS)
+    _add_columns(connection, "Yearly_statistics", ACCUMULATOR_COLUMNS)
+
+#3: integer day keys (e.g. 20201031) on the readings and daily statistics, month keys
+# (e.g. 202010) on the monthly statistics, and an index on the readings' (variable, date)
+def _upgrade_day_keys(connection):
+    if len(_get_columns(connection, "Reading")) == 0:
+        return
+
+    _add_columns(connection, "Reading", [("daykey", "INTEGER")])
+    _add_columns(connection, "Daily_statistics", [("daykey", "INTEGER")])
+    _add_columns(connection, "Monthly_statistics", [("monthkey", "INTEGER")])
+
+    print("Filling in day keys")
+    connection.execute('''UPDATE "Reading" SET "daykey" = CAST(strftime('%Y%m%d', "date") AS INTEGER) '''
+                       'WHERE "daykey" IS NULL')
+    connection.execute('UPDATE "Daily_statistics" SET "daykey" = '
+                       '(SELECT m."year"*10000 + m."month"*100 + d."day" FROM "Day" d JOIN "Month" m ON d."month" = m."id" '
+                       'WHERE d."id" = "Daily_statistics"."day") WHERE "daykey" IS NULL')
+    connection.execute('UPDATE "Monthly_statistics" SET "monthkey" = '
+                       '(SELECT m."year"*100 + m."month" FROM "Month" m WHERE m."id" = "Monthly_statistics"."month") '
+                       'WHERE "monthkey" IS NULL')
+
+    #these are named as pony would name them, so pony treats them as its own
+    print("Creating indexes")
+    connection.execute('CREATE INDEX IF NOT EXISTS "idx_reading__variable_date" ON "Reading" ("variable", "date")')
+    connection.execute('CREATE INDEX IF NOT EXISTS "idx_reading__daykey" ON "Reading" ("daykey")')
+    connection.execute('CREATE INDEX IF NOT EXISTS "idx_daily_statistics__variable_daykey" ON "Daily_statistics" ("variable", "daykey")')
+    connection.execute('CREATE INDEX IF NOT EXISTS "idx_monthly_statistics__variable_monthkey" ON "Monthly_statistics" ("variable", "monthkey")')
+
+UPGRADES = [_upgrade_accumulators, _upgrade_rollup_accumulators, _upgrade_day_keys]
+
+#Applies any upgrades that have not yet been applied to the database file 'dbfile'
+def upgrade_database(dbfile):
+    #a new database is created by pony with the latest schema
+    if not os.path.exists(dbfile):
+        return
+
+    connection = sqlite3.connect(dbfile)
+    try:
+        version = connection.execute("PRAGMA user_version").fetchone()[0]
+        for i in range(version, len(UPGRADES)):
+            print("Upgrading database '%s' to version %d"%(dbfile,i+1))
+            with connection:
+                UPGRADES[i](connection)
+                connection.execute("PRAGMA user_version = %d"%(i+1))
+    finally:
+        connection.close()
+
 
 #extracts the date from a filename and turns it into a datetime object (at 00:00:00)
 def date_from_filename(fname):
@@ -11,6 +95,7 @@ def date_from_filename(fname):
 
 #Reads in a TempHum logfile and if its contents are not already in the db, puts them in it
 def read_TempHum_file(file):
+    from utils import logger
 
     day = date_from_filename(file)
 
@@ -33,6 +118,7 @@ def read_TempHum_file(file):
         return
    
     #loop through lines in file, and add readings if they are not already in the database
+    batch=[]
     i=0
     for line in lines:
         #for i<numdb, the readings are already in the db. Skip
@@ -54,17 +140,11 @@ def read_TempHum_file(file):
         #put the attempts in as metadata (in json format)
         metadata = json.dumps({"attempts":attempts})
 
-        #register the data, opting to not recompute the statistics as we will do this at the end of the day
-        logger.register_reading(variable="Temperature",
-                                value = temperature, 
-                                date=day+dt,
-                                metadata = metadata,
-                                recompute_statistics=False)
-        logger.register_reading(variable="Humidity",
-                                value = humidity, 
-                                date=day+dt,
-                                metadata = metadata,
-                                recompute_statistics=False)
+        batch.append(("Temperature", temperature, day+dt, metadata))
+        batch.append(("Humidity", humidity, day+dt, metadata))
+
+    #register the data in one transaction, opting to not recompute the statistics as we will do this at the end of the day
+    logger.register_readings(batch, recompute_statistics=False)
     
     #update/generate the statistics for this day
     logger.generate_daily_statistics(day.year,day.month,day.day,"Temperature")
@@ -76,6 +156,18 @@ def read_TempHum_file(file):
 
 
 if __name__ == "__main__":
+    from utils import logger
+
+    #'python -m utils.migrate upgrade [dbfile]' upgrades a database file to the latest schema in place
+    # (this is also done automatically whenever the database is opened)
+    if len(sys.argv) > 1 and sys.argv[1] == "upgrade":
+        if len(sys.argv) > 2:
+            dbfile = sys.argv[2]
+        else:
+            dbfile = os.path.join(logger.dbdir,logger.dbname)
+        upgrade_database(dbfile)
+        sys.exit(0)
+
     logger.connect_logger_database()
 
     #register temperature and humidity with the database
@@ -0,0 +1,109 @@
+import os
+import time
+import threading
+import traceback
+import collections
+import matplotlib.pyplot as plt
+
+plt.switch_backend('Agg')
+
+
+#Renders plots in a background thread, so that logging a reading doesn't have to wait
+# for matplotlib.
+#
+# A plot is requested with request(fname, func, *args), which marks the plot file 'fname'
+# as dirty. The renderer thread then calls func(*args, fname) to (re)draw it. Any further
+# requests for the same file made before it has been rendered are merged into one, and
+# each file is rendered at most once every 'interval' seconds, so a plot that is requested
+# with every reading is only redrawn every 'interval' seconds however fast readings come in.
+#
+# If background is False, plots are rendered straight away when they are requested.
+class PlotRenderer:
+    def __init__(self, interval=60, background=True):
+        self.interval = interval
+        self.background = background
+
+        #plots waiting to be rendered (fname: (func, args)), in the order they were requested
+        self.pending = collections.OrderedDict()
+        #when each plot was last rendered (time.monotonic)
+        self.last_rendered = {}
+
+        self.condition = threading.Condition()
+        #matplotlib's pyplot is not thread safe, so only render one plot at a time
+        self.render_lock = threading.Lock()
+        self.thread = None
+
+    #marks the plot 'fname' as needing to be rendered by calling func(*args, fname)
+    def request(self, fname, func, *args):
+        if not self.background:
+            self._render(fname, func, args)
+            return
+
+        with self.condition:
+            self.pending[fname] = (func, args)
+
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="PlotRenderer")
+                self.thread.daemon = True
+                self.thread.start()
+
+            self.condition.notify()
+
+    #renders all the pending plots now (e.g. before the program exits)
+    def flush(self):
+        with self.condition:
+            items = list(self.pending.items())
+            self.pending.clear()
+
+        for fname, (func, args) in items:
+            self._render(fname, func, args)
+
+    #returns the next plot that is due to be rendered (or None), and how long until
+    # the next one will be due (or None if there are no plots waiting)
+    def _next(self):
+        now = time.monotonic()
+        wait = None
+        for fname in self.pending:
+            due = self.last_rendered.get(fname, now - self.interval) + self.interval
+            if due <= now:
+                func, args = self.pending.pop(fname)
+                return (fname, func, args), None
+            if wait is None or due - now < wait:
+                wait = due - now
+        return None, wait
+
+    #the renderer thread
+    def _run(self):
+        while True:
+            with self.condition:
+                item, wait = self._next()
+                while item is None:
+                    self.condition.wait(wait)
+                    item, wait = self._next()
+
+            fname, func, args = item
+            self._render(fname, func, args)
+
+    def _render(self, fname, func, args):
+        with self.render_lock:
+            self.last_rendered[fname] = time.monotonic()
+            try:
+                func(*args, fname)
+            except Exception as e:
+                print("Warning: Unable to render plot '%s': %s"%(fname,e))
+                traceback.print_exc()
+
+
+
+#Saves the current figure to 'fname' (as a png).
+# The plot is written to a temporary file which then replaces 'fname', so anything
+# reading the file (e.g. the website) never sees a partially written plot
+def save_figure(fname):
+    tmpname = "%s.%d.tmp"%(fname, os.getpid())
+    try:
+        plt.savefig(tmpname, format="png")
+        os.replace(tmpname, fname)
+    finally:
+        plt.close()
+        if os.path.exists(tmpname):
+            os.remove(tmpname)
@@ -0,0 +1,97 @@
+import collections
+import threading
+import numpy as np
+
+#Least squares fitting of a sinusoid of known frequency (e.g. the 50Hz of the mains) to
+# a burst of samples.
+#
+# The model is v(t) = offset + S*sin(omega*t) + C*cos(omega*t), which is linear in
+# (offset, S, C), so it is solved in one step with np.linalg.lstsq against the basis
+# matrix [1, sin(omega*t), cos(omega*t)].
+#
+# Bursts from the ADC are sampled on (nearly) the same grid every time, so the basis
+# matrices are cached by grid: (number of samples, sample spacing, frequency). Times
+# are taken relative to the first sample, so the phase is the phase at the first sample.
+
+#samples may be this far (s) from a regular grid for the grid's cached basis to be used
+GRID_TOLERANCE = 1e-4
+
+#the most basis matrices we cache
+MAX_CACHED = 8
+
+#The result of a fit:
+# offset - the DC offset of the signal
+# amplitude - the amplitude of the sinusoid
+# phase - the phase (radians) of the sinusoid at the first sample, as amplitude*sin(omega*t + phase)
+# rms - the RMS of the sinusoid (i.e. with the offset removed)
+# noise - the RMS of the residuals of the fit (noise, harmonics etc.)
+Fit = collections.namedtuple("Fit", ["offset", "amplitude", "phase", "rms", "noise"])
+
+#cached basis matrices, as {(n, dt, freq): basis}, least recently used first
+_bases = collections.OrderedDict()
+_lock = threading.Lock()
+
+
+#returns the basis matrix for the times t (relative to t[0])
+def _make_basis(t, omega):
+    basis = np.empty((len(t), 3))
+    basis[:,0] = 1.
+    np.sin(omega*t, out=basis[:,1])
+    np.cos(omega*t, out=basis[:,2])
+    return basis
+
+#Returns the basis matrix for the sample times t.
+# If the times are (within GRID_TOLERANCE) on a regular grid, the grid's cached basis is
+# returned, otherwise one is made for the times as they are
+def get_basis(t, freq):
+    t = np.asarray(t, dtype=np.float64)
+    t = t - t[0]
+    n = len(t)
+    omega = 2*np.pi*freq
+
+    dt = t[-1]/(n - 1) if n > 1 else 0.
+    grid = np.arange(n)*dt
+    if np.max(np.abs(t - grid)) > GRID_TOLERANCE:
+        return _make_basis(t, omega)
+
+    #round the spacing so bursts on the same grid share a key
+    key = (n, round(dt, 7), freq)
+    with _lock:
+        basis = _bases.get(key)
+        if basis is not None:
+            _bases.move_to_end(key)
+            return basis
+
+    basis = _make_basis(grid, omega)
+    #the cached matrix is shared, so make sure nobody modifies it
+    basis.flags.writeable = False
+
+    with _lock:
+        _bases[key] = basis
+        while len(_bases) > MAX_CACHED:
+            _bases.popitem(last=False)
+    return basis
+
+
+#Fits a sinusoid of frequency freq (Hz) to the samples v taken at times t (s).
+# Returns a Fit
+def fit(t, v, freq=50.):
+    v = np.asarray(v, dtype=np.float64)
+    n = len(v)
+    if n < 3:
+        raise ValueError("At least 3 samples are needed to fit a sinusoid")
+
+    basis = get_basis(t, freq)
+    (offset, S, C), residuals = np.linalg.lstsq(basis, v, rcond=None)[:2]
+
+    amplitude = np.hypot(S, C)
+    phase = np.arctan2(C, S)
+
+    #lstsq only returns the sum of the squared residuals if the fit is overdetermined
+    if len(residuals) > 0 and n > 3:
+        noise = np.sqrt(residuals[0]/(n - 3))
+    else:
+        noise = 0.
+
+    return Fit(offset=float(offset), amplitude=float(amplitude), phase=float(phase),
+               rms=float(amplitude/np.sqrt(2)), noise=float(noise))
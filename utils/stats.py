@@ -0,0 +1,276 @@
+import math
+import json
+import numpy as np
+
+#Streaming statistics used by the logger.
+#
+# Rather than re-reading every reading for a day each time a new one comes in, each
+# statistics table stores a small running 'accumulator' alongside it:
+#    count  - number of readings
+#    valsum - sum of the readings
+#    m2     - sum of squared differences from the mean (Welford's algorithm)
+#    minval - smallest reading
+#    maxval - largest reading
+#    sketch - a quantile sketch (see below), stored as json
+# Adding a reading to these is O(1), and the mean, standard deviation etc can be
+# calculated directly from them.
+#
+# Accumulators can also be merged, so the statistics for a month are computed by
+# merging those of its days, and a year's by merging its months. This gives the same
+# result as computing them over all the readings in the month/year at once.
+
+
+#Relative accuracy of the quantile sketch
+ALPHA = 0.01
+
+#Values closer to zero than this are counted in the sketch's zero bucket
+MIN_VALUE = 1e-9
+
+
+#Quantile sketch with a relative error guarantee (the 'DDSketch' algorithm).
+#
+# Values are counted in logarithmically spaced buckets, with bucket i covering
+# (gamma^(i-1), gamma^i] where gamma = (1+alpha)/(1-alpha). Negative values are
+# kept in a mirrored set of buckets, and values within MIN_VALUE of zero in a bucket
+# of their own.
+#
+# Error bound: any quantile returned by the sketch is within a relative error of
+# alpha of the true value, i.e. |estimate - true| <= alpha*|true|. With the default
+# alpha of 1% a median temperature of 20.0 is reported somewhere in [19.8,20.2].
+# (The bucket a quantile falls in is exact, so no further error is introduced by
+# merging sketches or by the order in which values are added.)
+#
+# The number of buckets depends on the range of the values, not on how many there
+# are: ~log(max/min)/(2*alpha), so values spanning 1 to 10000 need ~460 buckets.
+class QuantileSketch:
+    def __init__(self, alpha=ALPHA):
+        self.alpha = alpha
+        self.gamma = (1. + alpha)/(1. - alpha)
+        self.lngamma = math.log(self.gamma)
+
+        self.positive = {}
+        self.negative = {}
+        self.zero = 0
+        self.count = 0
+
+    #returns the bucket index for a (positive, non-zero) value
+    def _index(self, value):
+        return int(math.ceil(math.log(value)/self.lngamma))
+
+    #returns the representative value of bucket i
+    def _value(self, i):
+        return 2.*self.gamma**i/(self.gamma + 1.)
+
+    #adds a single value to the sketch
+    def add(self, value):
+        if value > MIN_VALUE:
+            i = self._index(value)
+            self.positive[i] = self.positive.get(i,0) + 1
+        elif value < -MIN_VALUE:
+            i = self._index(-value)
+            self.negative[i] = self.negative.get(i,0) + 1
+        else:
+            self.zero += 1
+        self.count += 1
+
+    #adds an array of values to the sketch (vectorised version of add)
+    def add_many(self, values):
+        values = np.asarray(values, dtype=np.float64)
+
+        for store, vals in ((self.positive, values[values > MIN_VALUE]),
+                            (self.negative, -values[values < -MIN_VALUE])):
+            if len(vals) == 0:
+                continue
+            indices = np.ceil(np.log(vals)/self.lngamma).astype(np.int64)
+            buckets, counts = np.unique(indices, return_counts=True)
+            for i, n in zip(buckets.tolist(), counts.tolist()):
+                store[i] = store.get(i,0) + n
+
+        self.zero += int(np.count_nonzero(np.abs(values) <= MIN_VALUE))
+        self.count += len(values)
+
+    #returns (an estimate of) quantile q of the values, e.g. q=0.5 for the median
+    def quantile(self, q):
+        if self.count == 0:
+            return None
+
+        #the rank of the value we want
+        rank = q*(self.count - 1)
+
+        #walk through the buckets from the most negative value to the most positive
+        n = 0
+        for i in sorted(self.negative, reverse=True):
+            n += self.negative[i]
+            if n > rank:
+                return -self._value(i)
+
+        n += self.zero
+        if n > rank:
+            return 0.
+
+        for i in sorted(self.positive):
+            n += self.positive[i]
+            if n > rank:
+                return self._value(i)
+
+        return self._value(max(self.positive))
+
+    def median(self):
+        return self.quantile(0.5)
+
+    #merges another sketch into this one (e.g. to combine days into a month)
+    def merge(self, other):
+        if other.alpha != self.alpha:
+            raise ValueError("Cannot merge sketches with different accuracies")
+        for i, n in other.positive.items():
+            self.positive[i] = self.positive.get(i,0) + n
+        for i, n in other.negative.items():
+            self.negative[i] = self.negative.get(i,0) + n
+        self.zero += other.zero
+        self.count += other.count
+
+    #serialises the sketch to a string (to store in the database)
+    def dumps(self):
+        return json.dumps({"alpha": self.alpha,
+                           "zero": self.zero,
+                           "positive": self.positive,
+                           "negative": self.negative})
+
+    #creates a sketch from a string created by dumps
+    @classmethod
+    def loads(cls, s):
+        d = json.loads(s)
+        sketch = cls(alpha=d["alpha"])
+        sketch.zero = d["zero"]
+        #json turns the (integer) keys into strings, so turn them back
+        sketch.positive = {int(i): n for i, n in d["positive"].items()}
+        sketch.negative = {int(i): n for i, n in d["negative"].items()}
+        sketch.count = sketch.zero + sum(sketch.positive.values()) + sum(sketch.negative.values())
+        return sketch
+
+
+
+#Running statistics for a set of values.
+# Values are added one at a time with add (or many at once with add_many), and the
+# state can be loaded from/stored to a statistics table in the database
+class Accumulator:
+    def __init__(self):
+        self.count = 0
+        self.valsum = 0.
+        self.m2 = 0.
+        self.minval = None
+        self.maxval = None
+        self.sketch = QuantileSketch()
+
+    #adds a value, updating the running statistics (Welford's algorithm)
+    def add(self, value):
+        value = float(value)
+        if self.count > 0:
+            delta = value - self.valsum/self.count
+        else:
+            delta = 0.
+        self.count += 1
+        self.valsum += value
+        self.m2 += delta*(value - self.valsum/self.count)
+
+        if self.minval is None or value < self.minval:
+            self.minval = value
+        if self.maxval is None or value > self.maxval:
+            self.maxval = value
+
+        self.sketch.add(value)
+
+    #adds an array of values in one go
+    def add_many(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        if len(values) == 0:
+            return
+
+        #compute the statistics for the new values then combine them with the existing ones
+        n = len(values)
+        mean = np.mean(values)
+        m2 = float(np.sum((values - mean)**2))
+
+        if self.count > 0:
+            delta = mean - self.valsum/self.count
+            self.m2 += m2 + delta*delta*self.count*n/(self.count + n)
+        else:
+            self.m2 = m2
+        self.count += n
+        self.valsum += float(np.sum(values))
+
+        vmin = float(np.min(values))
+        vmax = float(np.max(values))
+        if self.minval is None or vmin < self.minval:
+            self.minval = vmin
+        if self.maxval is None or vmax > self.maxval:
+            self.maxval = vmax
+
+        self.sketch.add_many(values)
+
+    #merges another accumulator into this one, as if all its values had been added to this one.
+    # (Chan et al's parallel algorithm for combining the M2s)
+    def merge(self, other):
+        if other.count == 0:
+            return
+        if self.count > 0:
+            delta = other.valsum/other.count - self.valsum/self.count
+            self.m2 += other.m2 + delta*delta*self.count*other.count/(self.count + other.count)
+        else:
+            self.m2 = other.m2
+        self.count += other.count
+        self.valsum += other.valsum
+
+        if self.minval is None or other.minval < self.minval:
+            self.minval = other.minval
+        if self.maxval is None or other.maxval > self.maxval:
+            self.maxval = other.maxval
+
+        self.sketch.merge(other.sketch)
+
+    #creates an accumulator by merging a number of others (e.g. the days in a month)
+    @classmethod
+    def merged(cls, accumulators):
+        acc = cls()
+        for other in accumulators:
+            acc.merge(other)
+        return acc
+
+    def mean(self):
+        if self.count == 0:
+            return None
+        return self.valsum/self.count
+
+    #(population) standard deviation, as numpy's np.std
+    def stddev(self):
+        if self.count == 0:
+            return None
+        return math.sqrt(max(self.m2,0.)/self.count)
+
+    #Median, estimated from the quantile sketch (to within a relative error of ALPHA)
+    def median(self):
+        return self.sketch.median()
+
+    #Loads an accumulator from a statistics table. Returns None if the table has no accumulator stored
+    @classmethod
+    def load(cls, stats):
+        if stats.count is None:
+            return None
+        acc = cls()
+        acc.count = stats.count
+        acc.valsum = stats.valsum
+        acc.m2 = stats.m2
+        acc.minval = stats.minval
+        acc.maxval = stats.maxval
+        if stats.sketch:
+            acc.sketch = QuantileSketch.loads(stats.sketch)
+        return acc
+
+    #stores the accumulator in a statistics table
+    def store(self, stats):
+        stats.count = self.count
+        stats.valsum = self.valsum
+        stats.m2 = self.m2
+        stats.minval = self.minval
+        stats.maxval = self.maxval
+        stats.sketch = self.sketch.dumps()
@@ -0,0 +1,189 @@
+import sys
+import math
+import datetime
+import numpy as np
+import pony.orm as pny
+
+from . import db
+from .binning import bin_statistics
+from .columns import fetch_readings, to_datetime64
+
+#A pyramid of pre-aggregated 'tiles' of each variable's readings, for plotting long time
+# ranges without loading every reading.
+#
+# Each level of the pyramid splits time into fixed width bins (1 minute, 10 minutes,
+# 1 hour and 1 day), and each tile records the count, total, min and max of the readings
+# in one bin. Tiles are updated as readings are registered (see logger.register_readings),
+# and can be rebuilt from the readings with rebuild_tiles, e.g. for a database that
+# existed before tiles did:
+#    python -m utils.tiles rebuild [variable ...]
+#
+# get_tiles returns the tiles covering a time window from the level whose number of tiles
+# in the window is closest to 'points', so a plot of a year uses the daily tiles and a plot
+# of an afternoon the 1 minute tiles.
+#
+# Tile start times are milliseconds since the epoch (of local time as if it were UTC, like
+# the microseconds returned by columns.py), so daily tiles start at local midnight.
+
+#the widths of each level of the pyramid (in seconds), finest first
+LEVELS = [60, 600, 3600, 86400]
+
+#readings are fetched this many days at a time when rebuilding tiles
+_REBUILD_DAYS = 30
+
+#the rows returned by get_tiles' query
+_dtype = np.dtype([("start", np.int64), ("count", np.int64), ("total", np.float64),
+                   ("minval", np.float64), ("maxval", np.float64)])
+
+_SELECT = ('SELECT "start", "count", "total", "minval", "maxval" FROM "Tile" '
+           'WHERE "variable" = ? AND "level" = ? AND "start" >= ? AND "start" < ? ORDER BY "start"')
+
+_EPOCH = datetime.datetime(1970,1,1)
+
+
+#returns a datetime as milliseconds since the epoch (see columns.py)
+def _epoch_ms(date):
+    delta = date - _EPOCH
+    return (delta.days*86400 + delta.seconds)*1000 + delta.microseconds//1000
+
+#returns the start (in ms) of the tile on 'level' that the time t (in ms) falls in
+def _tile_start(t, level):
+    width = level*1000
+    return (t//width)*width
+
+
+#returns the level to use for a window 'span' seconds long: the one whose number of tiles
+# in the window is closest to 'points' (by ratio, so 365 daily tiles beat 8760 hourly ones
+# for 1000 points)
+def choose_level(span, points=1000):
+    span = max(span, 1.)
+    return min(LEVELS, key=lambda level: abs(math.log(span/level/points)))
+
+
+#Adds a batch of readings to the tiles.
+# readings is a list of (Variable, date, value), where Variable is a db.Variable. This must
+# be called inside a db_session (the one the readings are registered in)
+def update_tiles(readings):
+    #aggregate the batch into the tiles it touches first, so each tile is only updated once
+    updates = {}
+    for variable, date, value in readings:
+        t = _epoch_ms(date)
+        for level in LEVELS:
+            key = (variable, level, _tile_start(t, level))
+            update = updates.get(key)
+            if update is None:
+                updates[key] = [1, value, value, value]
+            else:
+                update[0] += 1
+                update[1] += value
+                update[2] = min(update[2], value)
+                update[3] = max(update[3], value)
+
+    for (variable, level, start), (count, total, minval, maxval) in updates.items():
+        tile = db.Tile.get(variable=variable, level=level, start=start)
+        if tile is None:
+            db.Tile(variable=variable, level=level, start=start, count=count, total=total, minval=minval, maxval=maxval)
+        else:
+            tile.count += count
+            tile.total += total
+            tile.minval = min(tile.minval, minval)
+            tile.maxval = max(tile.maxval, maxval)
+
+
+#Rebuilds a variable's tiles in [start, end) (whole days) from its readings.
+# (If start or end are None they default to the day of the variable's first/last reading)
+def rebuild_tiles(variable, start=None, end=None):
+    first, last = _get_reading_range(variable)
+    if first is None:
+        return
+
+    if start is None:
+        start = first
+    if end is None:
+        end = last + datetime.timedelta(days=1)
+    start = datetime.datetime(start.year, start.month, start.day)
+    end = datetime.datetime(end.year, end.month, end.day)
+
+    #one chunk of days at a time, so we never hold too many readings in memory. The
+    # chunks start at midnight so they never split a tile
+    chunk = start
+    while chunk < end:
+        chunkend = min(chunk + datetime.timedelta(days=_REBUILD_DAYS), end)
+        _rebuild_chunk(variable, chunk, chunkend)
+        chunk = chunkend
+
+@pny.db_session
+def _get_reading_range(variable):
+    return (pny.min(r.date for r in db.Reading if r.variable.name == variable),
+            pny.max(r.date for r in db.Reading if r.variable.name == variable))
+
+#replaces the tiles of a variable in [start, end) with ones computed from its readings
+@pny.db_session
+def _rebuild_chunk(variable, start, end):
+    Variable = db.Variable[variable]
+    t0 = _epoch_ms(start)
+    t1 = _epoch_ms(end)
+    pny.delete(tile for tile in db.Tile if tile.variable == Variable and tile.start >= t0 and tile.start < t1)
+
+    t, v = fetch_readings(variable, start, end)
+    if len(t) == 0:
+        return
+    t = to_datetime64(t)
+
+    for level in LEVELS:
+        stats = bin_statistics(t, v, np.datetime64(start,"ms"), np.timedelta64(level,"s"))
+        starts = t0 + stats["index"]*level*1000
+        for i in range(len(starts)):
+            db.Tile(variable=Variable, level=level, start=int(starts[i]), count=int(stats["count"][i]),
+                    total=float(stats["total"][i]), minval=float(stats["minval"][i]), maxval=float(stats["maxval"][i]))
+
+    print("Rebuilt tiles for '%s' from %s to %s (%d readings)"%(variable, start.date(), end.date(), len(t)))
+
+
+#Returns the tiles of 'variable' covering [start, end) (datetimes), from the level giving
+# closest to 'points' tiles in the window (see choose_level), or from 'level' if given.
+# Returns the level used and a dictionary of arrays, one element per (non-empty) tile:
+#    t      - the start of each tile, as a datetime64
+#    count  - the number of readings in the tile
+#    mean   - the mean of the readings
+#    minval - the smallest reading
+#    maxval - the largest reading
+#    total  - the total of the readings
+@pny.db_session
+def get_tiles(variable, start, end, points=1000, level=None):
+    if level is None:
+        level = choose_level((end - start).total_seconds(), points)
+
+    #include the tile the window starts part way through
+    t0 = _tile_start(_epoch_ms(start), level)
+    t1 = _epoch_ms(end)
+
+    cursor = db.db.get_connection().cursor()
+    cursor.execute(_SELECT, (variable, level, t0, t1))
+    rows = np.fromiter(cursor, dtype=_dtype)
+    cursor.close()
+
+    return level, {
+        "t": rows["start"].astype("datetime64[ms]"),
+        "count": rows["count"],
+        "mean": rows["total"]/np.maximum(rows["count"], 1),
+        "minval": rows["minval"],
+        "maxval": rows["maxval"],
+        "total": rows["total"],
+    }
+
+
+if __name__ == "__main__":
+    from utils import logger
+
+    #'python -m utils.tiles rebuild [variable ...]' rebuilds the tiles of the given variables
+    # (or all of them) from their readings
+    if len(sys.argv) > 1 and sys.argv[1] == "rebuild":
+        logger.init()
+        variables = sys.argv[2:]
+        if len(variables) == 0:
+            variables = [v["name"] for v in logger.get_variables()]
+        for variable in variables:
+            rebuild_tiles(variable)
+    else:
+        print("Usage: python -m utils.tiles rebuild [variable ...]")
@@ -0,0 +1,76 @@
+import numpy as np
+
+#Synthetic signals for checking the power monitor's measurements without any hardware.
+#
+# A load profile is the power (W) drawn over time, as a piecewise linear function given by
+# arrays of times (s) and powers (W), held constant before the first and after the last
+# time. Its exact energy over any interval is known, so the energy integrated from
+# measurements of it can be checked (see benchmarks/integrator.py).
+#
+# The voltages the ADC would see can be made with sinusoid(), and fed through the same
+# code as real readings, e.g. with drivers.FakeSMBus.
+
+
+#sample times of a burst of n readings at rate (samples/s) starting at t0, with normally
+# distributed timing jitter (s)
+def burst_times(t0, n=500, rate=860., jitter=0.):
+    t = t0 + np.arange(n)/rate
+    if jitter > 0:
+        t += np.random.normal(0, jitter, n)
+    return t
+
+#A sinusoid of the given amplitude and frequency at times t, on top of a DC offset, with
+# normally distributed noise (of standard deviation noise) and harmonics, given as a list
+# of (harmonic number, relative amplitude) e.g. [(3, 0.1)]
+def sinusoid(t, amplitude, freq=50., offset=0., phase=0., noise=0., harmonics=()):
+    t = np.asarray(t, dtype=np.float64)
+    omega = 2*np.pi*freq
+    v = offset + amplitude*np.sin(omega*t + phase)
+    for n, a in harmonics:
+        v += a*amplitude*np.sin(n*(omega*t + phase))
+    if noise > 0:
+        v += np.random.normal(0, noise, len(t))
+    return v
+
+
+#Load profiles
+
+#a constant load
+def constant_load(power):
+    return np.array([0.]), np.array([float(power)])
+
+#a load switching between powers at the given times, e.g. step_load([0, 60], [100, 2000, 100])
+# draws 100W until t=0, 2000W until t=60 then 100W. The steps take 'rise' s
+def step_load(times, powers, rise=0.01):
+    if len(powers) != len(times) + 1:
+        raise ValueError("There must be one more power than times")
+    t = [times[0] - rise]
+    p = [powers[0]]
+    for i, ts in enumerate(times):
+        if i > 0:
+            t.append(ts - rise)
+            p.append(powers[i])
+        t.append(ts)
+        p.append(powers[i + 1])
+    return np.array(t, dtype=np.float64), np.array(p, dtype=np.float64)
+
+#a random load, changing linearly between random powers in [low, high] every 'interval' s
+# between t0 and t1
+def random_load(t0, t1, interval=10., low=0., high=3000., seed=None):
+    rng = np.random.RandomState(seed)
+    t = np.arange(t0, t1 + interval, interval, dtype=np.float64)
+    return t, rng.uniform(low, high, len(t))
+
+#returns the power of a load profile at times t
+def load_power(profile, t):
+    times, powers = profile
+    return np.interp(t, times, powers)
+
+#returns the energy (J) used by a load profile between t0 and t1
+def load_energy(profile, t0, t1):
+    times, powers = profile
+    #the profile is linear between its knots, so the trapezoidal rule is exact
+    inside = times[(times > t0) & (times < t1)]
+    t = np.concatenate(([t0], inside, [t1]))
+    p = np.interp(t, times, powers)
+    return float(np.sum(0.5*(p[1:] + p[:-1])*np.diff(t)))
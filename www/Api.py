@@ -0,0 +1,187 @@
+import json
+import hashlib
+import datetime
+import flask
+
+import utils.logger as logger
+from utils.columns import iter_readings
+from utils.tiles import get_tiles, LEVELS
+from . import PlotCache, Caching
+
+
+#A JSON API for the logged data, for dashboards etc.
+#
+#  /api/v1/variables                              - the variables in the database
+#  /api/v1/readings?variable=&start=&end=&resolution=
+#                                                 - a variable's readings in [start, end)
+#  /api/v1/stats/latest                           - the latest readings and 24h statistics
+#  /api/v1/stats/<year>[/<month>[/<day>]]         - the statistics for a year, month or day
+#
+# start and end are ISO dates/times (e.g. 2020-10-31 or 2020-10-31T12:00), in local time
+# unless they have a UTC offset, and default to the 24h up to now. Times are returned as
+# ISO local times, always with microseconds (DATE_FORMAT, e.g. 2020-10-31T12:00:00.000000),
+# whether they are raw readings, tiles or statistics. resolution is 'raw' (the default) for every reading, or 'auto' or one
+# of the tile levels in seconds (60, 600, 3600 or 86400) for aggregated tiles (see
+# utils/tiles.py), where 'auto' chooses the level giving the number of points closest to 1000.
+#
+# Results are streamed, one JSON object per line (NDJSON), or as a JSON array if
+# format=json. Raw readings are streamed straight from a database cursor, so memory use
+# doesn't depend on the length of the range.
+#
+# Responses carry an ETag and Last-Modified derived from the time of the latest reading,
+# so clients can revalidate with If-None-Match/If-Modified-Since and get a 304 back
+# (without us querying the database) if nothing has been logged since. The ETag is made
+# from the latest reading and the query as it was given, never from the times start and
+# end resolve to, so a default window is named (e.g. 'last24h') rather than dated by
+# now() and the ETag changes only when Last-Modified does.
+
+api = flask.Blueprint("api", __name__, url_prefix="/api/v1")
+
+MIMETYPES = {"ndjson": "application/x-ndjson", "json": "application/json"}
+#the name of the window readings are returned for if neither start nor end is given
+DEFAULT_WINDOW = "last24h"
+
+
+#the format all times are returned in
+DATE_FORMAT = "%Y-%m-%dT%H:%M:%S.%f"
+
+#Formats a time as DATE_FORMAT. date is a datetime, or a date as the database stores it
+# ('YYYY-MM-DD HH:MM:SS', with or without microseconds)
+def _FormatDate(date):
+    if isinstance(date, str):
+        date = datetime.datetime.fromisoformat(date)
+    return date.strftime(DATE_FORMAT)
+
+#encodes datetimes as DATE_FORMAT strings
+def _default(o):
+    if isinstance(o, datetime.datetime):
+        return _FormatDate(o)
+    raise TypeError("%r is not JSON serializable"%o)
+
+def _dumps(obj):
+    return json.dumps(obj, default=_default)
+
+#yields the rows generated by rows() as NDJSON, or as the chunks of a JSON array
+def _Encode(rows, format):
+    if format == "ndjson":
+        for row in rows():
+            yield _dumps(row) + "\n"
+        return
+
+    first = True
+    yield "["
+    for row in rows():
+        yield ("" if first else ",\n") + _dumps(row)
+        first = False
+    yield "]\n"
+
+
+#Parses an ISO date (or date and time) from the query string, or aborts with a 400.
+# Readings are logged in (naive) local time, so times with a UTC offset are converted to that
+def _ParseDate(name, default):
+    value = flask.request.args.get(name)
+    if value is None:
+        return default
+    try:
+        date = datetime.datetime.fromisoformat(value)
+    except ValueError:
+        flask.abort(400, "Invalid %s '%s'"%(name, value))
+    if date.tzinfo is not None:
+        date = date.astimezone().replace(tzinfo=None)
+    return date
+
+#Returns a streamed response of the rows generated by rows(), with an ETag and Last-Modified
+# derived from the latest reading. If the client's copy is still current we return a 304
+# and rows() is never called.
+# key names anything else the response depends on that isn't in the url (e.g. 'last24h'
+# for a window that isn't given), which is added to the ETag. It must not depend on the
+# time of the request, or the ETag would change with every one
+def _Stream(rows, key=None):
+    format = flask.request.args.get("format", "ndjson")
+    if format not in MIMETYPES:
+        flask.abort(400, "Invalid format '%s'. Valid formats are %s"%(format, list(MIMETYPES)))
+
+    latest = logger.get_latest_reading_date()
+    etag = hashlib.sha1(repr((latest, flask.request.full_path, key)).encode()).hexdigest()
+
+    #nothing is read from the database until the response is sent (which it won't be for a 304)
+    response = flask.Response(flask.stream_with_context(_Encode(rows, format)), mimetype=MIMETYPES[format])
+    response.set_etag(etag)
+    if latest is not None:
+        response.last_modified = Caching.HttpDate(latest)
+    response.headers["Cache-Control"] = "no-cache"
+
+    return response.make_conditional(flask.request)
+
+
+@api.route("/variables")
+def VariablesAPI():
+    return _Stream(logger.get_variables)
+
+
+@api.route("/readings")
+def ReadingsAPI():
+    variable = flask.request.args.get("variable")
+    if variable is None:
+        flask.abort(400, "variable must be given")
+    if variable not in logger.get_variable_names():
+        flask.abort(404, "Unknown variable '%s'"%variable)
+
+    end = _ParseDate("end", datetime.datetime.now())
+    start = _ParseDate("start", end - datetime.timedelta(days=1))
+
+    #the ETag is built from the query as given (see _Stream), which covers any start or
+    # end given, so only the default window needs naming
+    window = None
+    if "start" not in flask.request.args and "end" not in flask.request.args:
+        window = DEFAULT_WINDOW
+
+    resolution = flask.request.args.get("resolution", "raw")
+    if resolution == "raw":
+        def rows():
+            for date, value in iter_readings(variable, start, end):
+                #the dates come straight from the database as text
+                yield {"t": _FormatDate(date), "value": value}
+        return _Stream(rows, window)
+
+    if resolution == "auto":
+        level = None
+    else:
+        try:
+            level = int(resolution)
+        except ValueError:
+            level = None
+        if level not in LEVELS:
+            flask.abort(400, "Invalid resolution '%s'. Use 'raw', 'auto' or one of %s"%(resolution, LEVELS))
+
+    def rows():
+        level_used, tiles = get_tiles(variable, start, end, level=level)
+        t = tiles["t"].astype(datetime.datetime)
+        for i in range(len(t)):
+            yield {"t": _FormatDate(t[i]), "resolution": level_used, "count": int(tiles["count"][i]),
+                   "mean": float(tiles["mean"][i]), "minval": float(tiles["minval"][i]),
+                   "maxval": float(tiles["maxval"][i]), "total": float(tiles["total"][i])}
+    return _Stream(rows, window)
+
+
+#adds the url of each variable's plot to the statistics
+def _WithPlots(data, period):
+    for d in data or []:
+        d["plot"] = PlotCache.GetPlotURL(d["variable"], period)
+        yield d
+
+@api.route("/stats/latest")
+def LatestStatsAPI():
+    return _Stream(lambda: _WithPlots(logger.get_latest_readings(), "latest"))
+
+@api.route("/stats/<int:year>")
+def YearStatsAPI(year):
+    return _Stream(lambda: _WithPlots(logger.get_all_stats_for_year(year), "%04d"%year))
+
+@api.route("/stats/<int:year>/<int:month>")
+def MonthStatsAPI(year, month):
+    return _Stream(lambda: _WithPlots(logger.get_all_stats_for_month(year, month), "%04d-%02d"%(year,month)))
+
+@api.route("/stats/<int:year>/<int:month>/<int:day>")
+def DayStatsAPI(year, month, day):
+    return _Stream(lambda: _WithPlots(logger.get_all_stats_for_day(year, month, day), "%04d-%02d-%02d"%(year,month,day)))
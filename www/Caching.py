@@ -0,0 +1,112 @@
+import os
+import time
+import hashlib
+import datetime
+import flask
+from werkzeug.http import is_resource_modified
+
+import utils.logger as logger
+from . import FromLogs
+
+
+#HTTP caching for the website.
+#
+# Static files are linked to with fingerprinted urls (see StaticURL), e.g.
+# /static/style.css?v=3f2a9c1b, whose content never changes (the url changes with the
+# file), so browsers can cache them for a year without revalidating.
+#
+# Everything else is sent with 'Cache-Control: no-cache', so browsers keep a copy but check
+# it is still current before using it. Plots are sent with the hash of their data (see
+# PlotCache) as their ETag, and the time their file was rendered as their Last-Modified. The data pages
+# use the time of the newest reading shown on the page as their validator (see
+# NotModified), and answer a request from a browser with a current copy with a 304,
+# without querying the statistics or rendering the template.
+
+#how long browsers may cache fingerprinted static files (s)
+STATIC_MAX_AGE = 365*24*3600
+
+#when the website started. Part of every page's ETag, so pages are re-rendered after a
+# restart (e.g. if the templates have changed)
+_startup = time.time()
+
+#the fingerprints of the static files, as {filename: (mtime, fingerprint)}
+_fingerprints = {}
+
+
+#Returns the fingerprinted url of a static file (available in templates as static_url)
+def StaticURL(filename):
+    path = os.path.join(flask.current_app.static_folder, filename)
+    try:
+        mtime = os.stat(path).st_mtime
+    except OSError:
+        return flask.url_for("static", filename=filename)
+
+    cached = _fingerprints.get(filename)
+    if cached is None or cached[0] != mtime:
+        with open(path, "rb") as f:
+            cached = (mtime, hashlib.sha1(f.read()).hexdigest()[:8])
+        _fingerprints[filename] = cached
+
+    return flask.url_for("static", filename=filename, v=cached[1])
+
+
+#converts a date from the database (local time) to an HTTP date (UTC, to the second)
+def HttpDate(date):
+    return date.replace(microsecond=0).astimezone(datetime.timezone.utc)
+
+
+#Checks whether the browser's copy of a data page is still current. The page is
+# identified by its newest reading (last_modified, a datetime or None) and anything else
+# it depends on (key). Returns a 304 response if the browser's copy is current, otherwise
+# None, in which case the page should be rendered as normal (and it will be sent with
+# these validators by SetCacheHeaders)
+def NotModified(last_modified, *key):
+    etag = hashlib.sha1(repr((_startup, last_modified, key)).encode()).hexdigest()
+    if last_modified is not None:
+        last_modified = HttpDate(last_modified)
+
+    flask.g.validators = (etag, last_modified)
+
+    if is_resource_modified(flask.request.environ, etag=etag, last_modified=last_modified):
+        return None
+
+    return flask.Response(status=304)
+
+#Returns the validators for a data page about the readings in [start, end) (datetimes),
+# or the latest readings if start is None.
+# The latest data page also shows the age of the latest reading and links to the days
+# either side of today, which change with time even if nothing is logged, so its
+# validators include the current minute (and so the date)
+def DataPageValidators(start=None, end=None):
+    if start is None:
+        #this comes from the latest data snapshot, if there is one (see FromLogs)
+        latest = FromLogs.GetLatestReadingDate()
+        return (latest, datetime.datetime.now().strftime("%Y-%m-%d %H:%M"))
+
+    latest = logger.get_latest_reading_date()
+
+    #the list of months in the navigation changes when a new month starts
+    newest = logger.get_latest_reading_date(start, end)
+    month = (latest.year, latest.month) if latest is not None else None
+    return (newest, month)
+
+
+#after_request hook that sets the caching headers of a response
+def SetCacheHeaders(response):
+    #the API sets its own caching headers
+    if flask.request.blueprint == "api":
+        return response
+
+    if flask.request.endpoint == "static" and "v" in flask.request.args:
+        response.headers["Cache-Control"] = "public, max-age=%d, immutable"%STATIC_MAX_AGE
+        return response
+
+    validators = flask.g.get("validators")
+    if validators is not None:
+        etag, last_modified = validators
+        response.set_etag(etag)
+        if last_modified is not None:
+            response.last_modified = last_modified
+
+    response.headers["Cache-Control"] = "no-cache"
+    return response
@@ -0,0 +1,103 @@
+import time
+import functools
+import threading
+import collections
+
+import utils.logger as logger
+
+
+#An in-process cache of the results of the website's database queries.
+#
+# Functions decorated with @Memoize() remember their results, keyed by their arguments.
+# A cached result is used until:
+#  - the data version changes (see logger.get_data_version), i.e. anything is written to
+#    the database. Results that can't change (e.g. the data for a past day) can opt out
+#    of this with versioned=False
+#  - it is older than ttl seconds (if ttl is not None)
+#  - it is invalidated with func.invalidate() or Invalidate()
+#
+# The data version is read from the database at most once every VERSION_CHECK seconds,
+# so a page that calls several cached functions only costs one (cheap) query. When
+# something else reads it regularly (e.g. www.asgi's background refresh, see
+# FromLogs.RefreshLatestData), it can hand it over with SetVersion, and requests don't
+# read it at all.
+#
+# Cached results are shared between requests, so callers must not modify them.
+
+#how often the data version is re-read from the database (s)
+VERSION_CHECK = 1.
+
+#the most results each function caches
+MAX_ENTRIES = 256
+
+_lock = threading.Lock()
+#(data version, time.monotonic it was read, time.monotonic until which it needn't be re-read)
+_version = (None, None, None)
+#every memoized function's cache, for Invalidate
+_caches = []
+
+
+#returns the current data version, reading it from the database if it is more than
+# VERSION_CHECK seconds since we last did
+def DataVersion():
+    global _version
+    version, checked, valid_until = _version
+    now = time.monotonic()
+    if valid_until is not None and now < valid_until:
+        return version
+    if checked is None or now - checked > VERSION_CHECK:
+        version = logger.get_data_version()
+        _version = (version, now, None)
+    return version
+
+#sets the data version, which is then used (without reading it from the database) for
+# the next valid_for seconds
+def SetVersion(version, valid_for):
+    global _version
+    now = time.monotonic()
+    _version = (version, now, now + valid_for)
+
+
+#Decorator that caches the results of a function (see above)
+def Memoize(ttl=None, versioned=True):
+    def decorator(func):
+        #(args: (version, expires, result)), least recently used first
+        cache = collections.OrderedDict()
+        _caches.append(cache)
+
+        @functools.wraps(func)
+        def wrapper(*args):
+            version = DataVersion() if versioned else None
+            now = time.monotonic()
+
+            with _lock:
+                entry = cache.get(args)
+                if entry is not None and entry[0] == version and (entry[1] is None or now < entry[1]):
+                    cache.move_to_end(args)
+                    return entry[2]
+
+            result = func(*args)
+
+            with _lock:
+                cache[args] = (version, now + ttl if ttl is not None else None, result)
+                cache.move_to_end(args)
+                while len(cache) > MAX_ENTRIES:
+                    cache.popitem(last=False)
+            return result
+
+        def invalidate():
+            with _lock:
+                cache.clear()
+
+        wrapper.invalidate = invalidate
+        return wrapper
+    return decorator
+
+
+#empties every cache
+def Invalidate():
+    global _version
+    with _lock:
+        for cache in _caches:
+            cache.clear()
+        _version = (None, None, None)
@@ -54,6 +54,12 @@ def GetMonthString(year,month):
 
     return "%s %04d"%(mstr,year)
 
+#returns the first of the month after year/month (as a datetime)
+def FirstOfNextMonth(year, month):
+    if month == 12:
+        return datetime.datetime(year=year+1, month=1, day=1)
+    return datetime.datetime(year=year, month=month+1, day=1)
+
 #returns the previous and next years
 def PrevNextYear(year):
     ly = "%04d"%(year-1)
@@ -1,4 +1,6 @@
 import os
+import threading
+import collections
 
 #returns the paths and urls to the parent directorys
 #e.g. if the path is /foo/bar/blah returns the urls for [/foo,/foo/bar]
@@ -16,36 +18,96 @@ def get_parent_dirs(path):
     return parents
 
 
+#the keys a directory listing can be sorted by
+SORT_KEYS = ["name", "mtime", "size"]
 
-#creates a list of all files and directories in a directory
-def list_directory(dir,root):
-    #create list of items in the directory
+#the most directory listings we cache
+MAX_CACHED = 32
 
-    entries=os.listdir(dir)
+#cached directory listings, as {dir: (mtime, entries)}, least recently used first
+_listings = collections.OrderedDict()
+_lock = threading.Lock()
+
+
+#Reads the entries of a directory with os.scandir, whose DirEntrys know whether they are
+# files or directories without another stat. Hidden files are left out.
+# Returns a list of dicts (name, type, path), directories first, then by name
+def _scan(dir):
     files=[]
     dirs=[]
+    with os.scandir(dir) as it:
+        for entry in it:
+            if entry.name[0]==".": continue #do not show hidden files
+
+            d = {"name": entry.name, "path": entry.path}
+            if entry.is_dir():
+                d["type"]="dir"
+                dirs.append(d)
+            elif entry.is_file():
+                d["type"]="file"
+                files.append(d)
+
+    dirs.sort(key=lambda d: d["name"])
+    files.sort(key=lambda d: d["name"])
+    return dirs + files
+
+#Returns the (cached) entries of a directory (see _scan).
+# A directory's modification time changes when entries are added to or removed from it,
+# so the listing is only re-read when that changes
+def _get_entries(dir):
+    mtime = os.stat(dir).st_mtime_ns
+
+    with _lock:
+        cached = _listings.get(dir)
+        if cached is not None and cached[0] == mtime:
+            _listings.move_to_end(dir)
+            return cached[1]
+
+    entries = _scan(dir)
+
+    with _lock:
+        _listings[dir] = (mtime, entries)
+        _listings.move_to_end(dir)
+        while len(_listings) > MAX_CACHED:
+            _listings.popitem(last=False)
+    return entries
+
+#fills in the modification time and size of the entries (if we haven't already). These are
+# cached with the listing, so a file modified since may be sorted by its old time/size
+def _stat_entries(entries):
+    for d in entries:
+        if "mtime" not in d:
+            try:
+                st = os.stat(d["path"])
+                d["mtime"], d["size"] = st.st_mtime, st.st_size
+            except OSError:
+                d["mtime"], d["size"] = 0, 0
 
-    #sort this list
-    entries.sort()
 
-    for entry in entries:
-        dict = {}
+#Lists the files and directories in a directory.
+# Directories come first, then files, each sorted by 'sort' (one of SORT_KEYS), in reverse
+# order if reverse is True. Only the entries [offset, offset+limit) are returned (all of
+# them if limit is None).
+# Returns the list of entries (dicts of name, type, path and url) and the total number of
+# entries in the directory
+def list_directory(dir,root,sort="name",reverse=False,offset=0,limit=None):
+    entries = _get_entries(dir)
 
-        if entry[0]==".": continue #do not show hidden files
+    if sort != "name" or reverse:
+        if sort != "name":
+            #the stats are cached along with the listing, so this is only done once
+            _stat_entries(entries)
+        dirs = sorted((d for d in entries if d["type"] == "dir"), key=lambda d: d[sort], reverse=reverse)
+        files = sorted((d for d in entries if d["type"] == "file"), key=lambda d: d[sort], reverse=reverse)
+        entries = dirs + files
 
-        dict["name"]=entry
-        dict["url"]=os.path.join(root,entry)
-        path=os.path.join(dir,entry)
-        dict["path"]=path
-        if os.path.isfile(path):
-            dict["type"]="file"
-            files.append(dict)
-        elif os.path.isdir(path):
-            dict["type"]="dir"
-            dirs.append(dict)
-        # else:
-            # print("Error: unknown item '%s'"%entry)
+    total = len(entries)
+    end = total if limit is None else offset + limit
 
-    contents = dirs + files
+    contents = []
+    for d in entries[offset:end]:
+        d = dict(d)
+        d["url"]=os.path.join(root,d["name"])
+        contents.append(d)
 
-    return contents
+    return contents, total
@@ -1,11 +1,13 @@
 import os
 import datetime
+import time
 import numpy as np
 
 import utils.logger as logger
 import utils.GetConfig as GetConfig
-from .Status import command
-from . import Dates
+from .Status import FileSize
+from . import Dates, DataCache
+from .ViewModels import StatsViews
 
 
 
@@ -18,20 +20,25 @@ homedir = os.path.expanduser("~")
 #get the configuration for the logger
 dbconfig = GetConfig(key="logger")
 
+#cached results are refreshed at least this often (s), even if the data version hasn't changed
+cache_ttl = GetConfig(key="website").get("data_cache_ttl", 3600)
+
 #Gets all the months with data from the logger
 # returns a list of dictionaries containing:
 #    text: The text we wish the month to be rendered as e.g "January 2020"
 #    url: The url for this month e.g. /data/2020/01
+@DataCache.Memoize(ttl=cache_ttl)
 def GetAllMonths():
     
     Months = []
     
-    #get list of all the years with data
-    years = logger.get_years()
+    #get all the (year, month)s with data in one query
+    yearmonths = sorted(set((y, m) for (y, m, d) in logger.get_day_counts()))
+    years = sorted(set(y for (y, m) in yearmonths))
 
     for year in years:
-        #get list of all the months with data in this year
-        months = logger.get_months(year)
+        #the months with data in this year
+        months = [m for (y, m) in yearmonths if y == year]
 
         #construct thr dictionary for this month
         for month in months:
@@ -60,11 +67,14 @@ def GetAllMonths():
 #Generates a structure that will be rendered as a calendar with links to days with data
 # It is a list of rows, each containing 7 dictionaries corresponding to the 7 week days.
 # Each day is either blank (day not in month), just the number (day with no data) or
-# a hyperlink to a day with data
+# a hyperlink to a day with data. Days with data also have a density (1-4), which is how
+# many readings were taken that day relative to the busiest day of the month
+@DataCache.Memoize(ttl=cache_ttl)
 def CreateCalendar(year,month):
 
-    #get the list of days in the month with data entries
-    days=logger.get_days(year,month)
+    #get the number of readings on each day of the month with data
+    counts = {d: count for (y, m, d), count in logger.get_day_counts(year,month).items()}
+    maxcount = max(list(counts.values()) + [1])
 
     #Count the number of days in a month
     # first get the first of the next month, and count the number of days
@@ -107,9 +117,10 @@ def CreateCalendar(year,month):
             else:
                 dict["text"]="%d"%num
                 #If we have data, add the link to it
-                if num in days:
+                if num in counts:
                     dict["active"]=1
                     dict["url"]="%s/%02d"%(url,num)
+                    dict["density"]=max(1, int(np.ceil(4.*counts[num]/maxcount)))
                 #if no data we have no link
                 else:
                     dict["active"]=0
@@ -120,84 +131,97 @@ def CreateCalendar(year,month):
     
     return calendar
 
-#Gets the latest data from the db
-# is returned as a list of dictionaries, one per variable type
+#A snapshot of the latest data, as (time.monotonic it was taken, data, date of the latest
+# reading). When the website is served by www.asgi this is refreshed in the background
+# every few seconds (see RefreshLatestData), so GetLatestData and GetLatestReadingDate
+# (used for the /data page's validators) don't have to query the database
+_latest_snapshot = None
+
+#snapshots older than this (s) are not used
+snapshot_max_age = GetConfig(key="website").get("latest_snapshot_max_age", 30)
+
+#Gets the latest data, from the snapshot if there is a recent one, otherwise from the db
+# is returned as a tuple of StatsViews, one per variable type (see ViewModels)
 def GetLatestData():
+    snapshot = _latest_snapshot
+    if snapshot is not None and time.monotonic() - snapshot[0] < snapshot_max_age:
+        return snapshot[1]
 
-    latest = logger.get_latest_readings()
+    return _QueryLatestData()
 
-    data = PrepData(latest)
+#Gets the date of the latest reading, from the snapshot if there is a recent one, otherwise from the db
+def GetLatestReadingDate():
+    snapshot = _latest_snapshot
+    if snapshot is not None and time.monotonic() - snapshot[0] < snapshot_max_age:
+        return snapshot[2]
 
-    if data is not None:
-        for reading in data:
-        #create a string for the age of the data
-            age = datetime.datetime.now() - reading["timestamp"]
-            agestr = Dates.FuzzyTimeFromTimedelta(age)
-            reading["age"] = agestr
+    return logger.get_latest_reading_date()
+
+#Updates the snapshot of the latest data.
+# If it will be refreshed again within 'interval' seconds, the data version read along
+# with it is used by DataCache until then, rather than being read from the database
+def RefreshLatestData(interval=None):
+    global _latest_snapshot
+    version = logger.get_data_version()
+    _latest_snapshot = (time.monotonic(), _QueryLatestData(), logger.get_latest_reading_date())
+    if interval is not None:
+        #allow for the refresh running late
+        DataCache.SetVersion(version, 2*interval)
+
+def _QueryLatestData():
+
+    latest = logger.get_latest_readings()
 
-    return data
+    return StatsViews(latest,"latest")
 
 #Gets the data for a day from the db
-# is returned as a list of dictionaries, one per variable type
+# is returned as a tuple of StatsViews, one per variable type (see ViewModels)
+# Readings for a day stop arriving soon after it ends, so days before yesterday are
+# cached regardless of what else is written to the database
 def GetDataForDay(year,month,day):
+    if datetime.date(year,month,day) < datetime.date.today() - datetime.timedelta(days=1):
+        return _GetDataForPastDay(year,month,day)
+    return _GetDataForDay(year,month,day)
+
+@DataCache.Memoize(ttl=cache_ttl, versioned=False)
+def _GetDataForPastDay(year,month,day):
+    return _QueryDataForDay(year,month,day)
+
+@DataCache.Memoize(ttl=cache_ttl)
+def _GetDataForDay(year,month,day):
+    return _QueryDataForDay(year,month,day)
+
+def _QueryDataForDay(year,month,day):
 
     data = logger.get_all_stats_for_day(year,month,day)
 
-    return PrepData(data)
+    return StatsViews(data,"%04d-%02d-%02d"%(year,month,day))
 
 #Gets the data for a month from the db
-# is returned as a list of dictionaries, one per variable type
+# is returned as a tuple of StatsViews, one per variable type (see ViewModels)
+@DataCache.Memoize(ttl=cache_ttl)
 def GetDataForMonth(year,month):
 
     data = logger.get_all_stats_for_month(year,month)
 
-    return PrepData(data)
+    return StatsViews(data,"%04d-%02d"%(year,month))
 
 #Gets the data for a year from the db
-# is returned as a list of dictionaries, one per variable type
+# is returned as a tuple of StatsViews, one per variable type (see ViewModels)
+@DataCache.Memoize(ttl=cache_ttl)
 def GetDataForYear(year):
 
     data = logger.get_all_stats_for_year(year)
 
-    return PrepData(data)
-
-
-
-#prepares the data for use with the website    
-# Converts floats to strings etc
-def PrepData(data):
-    if data is not None:
-        for reading in data:
-            
-            
-            #Convert the floats to formatted strings
-            if reading["mean"] is not None:
-                reading["mean"] = "%4.1f"%reading["mean"]
-                reading["median"] = "%4.1f"%reading["median"]
-                reading["maxval"] = "%4.1f"%reading["maxval"]
-                reading["minval"] = "%4.1f"%reading["minval"]
-                reading["stddev"] = "%4.1f"%reading["stddev"]
-            if reading["total"] is not None:
-                reading["total"] = "%4.1f"%reading["total"]
-            if "value" in reading:
-                reading["value"] = "%4.1f"%reading["value"]
-            
-            #mangle the path for the image to something we can serve up
-            if reading["plot"] is not None:
-                path = os.path.relpath(reading["plot"],homedir)
-                reading["plot"] = os.path.join("/files",path)
-    
-    return data
+    return StatsViews(data,"%04d"%year)
+
+
 
 #gets the size of the database file (in human readable format)
 def GetDBFileSize():
     file = os.path.join(dbconfig["dbdir"],dbconfig["dbname"])
 
-    result = command(["du", "-h", "%s"%file])
-
-    size = result.split()[0]
-
-    return size
+    return FileSize(file)
 
 #returns the filename (path) of the file
 def GetDBFilename():
@@ -0,0 +1,113 @@
+import os
+import time
+import hashlib
+from urllib.parse import quote
+
+import utils.logger as logger
+from utils import GetConfig
+
+
+#Renders plots when they are requested by the website, and caches them on disk.
+#
+# Cached plots are named after a hash of the data they are drawn from (see
+# logger.get_plot_state), so a plot is only re-rendered once its data has changed, and
+# a stale plot can never be served. The hash is also the plot's ETag (see GetPlot).
+# The cache is limited to plot_cache_size MB, beyond which the least recently used plots
+# are removed. When a plot was last used is kept in its file's access time, so its
+# modification time (its Last-Modified) stays the time it was rendered.
+
+config = GetConfig(key="website")
+
+cachedir = config.get("plot_cache_dir", os.path.join(logger.plotdir,"cache"))
+cachesize = config.get("plot_cache_size", 50)*1024*1024
+
+#matplotlib's pyplot isn't thread safe, so share the logger's renderer's lock to
+# make sure only one plot is rendered at a time
+_lock = logger.renderer.render_lock
+
+
+#converts a period string into the (year, month, day) used by the logger
+# "latest" -> (None,None,None), "2020" -> (2020,None,None), "2020-10" -> (2020,10,None)
+# and "2020-10-31" -> (2020,10,31). Raises a ValueError if the period is not valid
+def ParsePeriod(period):
+    if period == "latest":
+        return None, None, None
+
+    parts = [int(p) for p in period.split("-")]
+    if len(parts) > 3:
+        raise ValueError("Invalid period '%s'"%period)
+    while len(parts) < 3:
+        parts.append(None)
+    return tuple(parts)
+
+#returns the url of the plot of a variable for a period (see ParsePeriod)
+def GetPlotURL(variable, period):
+    return "/plot/%s/%s"%(quote(variable), period)
+
+
+#Returns the path to the plot of a variable for a period, rendering it if it's not in
+# the cache, and its key (the hash of its data, which can be used as its ETag).
+# Returns (None, None) if there is no data to plot
+def GetPlot(variable, period):
+    year, month, day = ParsePeriod(period)
+
+    state = logger.get_plot_state(variable, year, month, day)
+    if state is None:
+        return None, None
+
+    key = hashlib.sha1(repr((variable, period, state)).encode()).hexdigest()
+    path = os.path.join(cachedir, "%s.png"%key)
+
+    #cache hit. Update its access time so it's marked as recently used
+    try:
+        os.utime(path, (time.time(), os.stat(path).st_mtime))
+        return path, key
+    except FileNotFoundError:
+        pass
+
+    with _lock:
+        #someone else may have rendered it while we waited for the lock
+        if not os.path.exists(path):
+            if not os.path.isdir(cachedir):
+                os.makedirs(cachedir)
+
+            if year is None:
+                logger.plot_latest(variable, path)
+            elif month is None:
+                logger.plot_yearly(year, variable, path)
+            elif day is None:
+                logger.plot_monthly(year, month, variable, path)
+            else:
+                logger.plot_daily(year, month, day, variable, path)
+
+            _Evict(keep=path)
+
+    return path, key
+
+
+#removes the least recently used plots from the cache until it is below the size limit
+# (apart from 'keep', the plot we've just rendered)
+def _Evict(keep=None):
+    entries = []
+    total = 0
+    with os.scandir(cachedir) as it:
+        for entry in it:
+            if entry.is_file() and entry.name.endswith(".png"):
+                stat = entry.stat()
+                total += stat.st_size
+                if entry.path != keep:
+                    entries.append((stat.st_atime, stat.st_size, entry.path))
+
+    if total <= cachesize:
+        return
+
+    #least recently used first
+    entries.sort()
+    for atime, size, path in entries:
+        if total <= cachesize:
+            break
+        try:
+            os.remove(path)
+            total -= size
+        except OSError:
+            pass
@@ -1,7 +1,152 @@
+import os
+import time
+import threading
 import subprocess
+import collections
+
+from utils import GetConfig
 
 #executes a shell command and returns its output
 def command(cmd):
     out = subprocess.check_output(cmd)
     out=out.decode().rstrip()
     return "%s"%out
+
+
+#Collects the system status shown on the status page.
+#
+# Where possible this is read straight from /proc and os.statvfs rather than running
+# commands. Anything that still needs a command (COMMANDS) is run concurrently. The
+# status is cached, and refreshed in a background thread every status_refresh seconds,
+# so GetStatus returns straight away however often the page is requested.
+
+config = GetConfig(key="website")
+refresh = config.get("status_refresh", 10)
+
+#commands whose output is shown on the status page, as {title: command}
+COMMANDS = collections.OrderedDict([("Network", ["ifconfig"])])
+
+#filesystem types that aren't real disks, which we leave out of the disk info
+_PSEUDO_FILESYSTEMS = set(["proc", "sysfs", "devpts", "cgroup", "cgroup2", "securityfs", "pstore",
+                           "debugfs", "tracefs", "configfs", "mqueue", "hugetlbfs", "fusectl",
+                           "autofs", "binfmt_misc", "bpf", "rpc_pipefs", "overlay", "squashfs", "nsfs"])
+
+_lock = threading.Lock()
+#the cached status
+_status = None
+_thread = None
+
+
+#formats a number of bytes in a human readable way (as du -h and df -h do), e.g. 1.5G
+def HumanSize(size):
+    for unit in ["", "K", "M", "G", "T"]:
+        if size < 1024 or unit == "T":
+            break
+        size /= 1024.
+    if unit == "":
+        return "%d"%size
+    if size < 10:
+        return "%.1f%s"%(size, unit)
+    return "%d%s"%(size, unit)
+
+#returns the disk space used by a file (like du -h)
+def FileSize(path):
+    return HumanSize(os.stat(path).st_blocks*512)
+
+
+#returns the usage of the mounted filesystems, formatted like df -h
+def DiskInfo():
+    lines = [("Filesystem", "Size", "Used", "Avail", "Use%", "Mounted on")]
+    seen = set()
+    with open("/proc/mounts") as f:
+        for line in f:
+            device, mountpoint, fstype = line.split()[:3]
+            #mount points with spaces in their names are escaped in /proc/mounts
+            mountpoint = mountpoint.replace("\\040", " ")
+            if fstype in _PSEUDO_FILESYSTEMS or mountpoint in seen:
+                continue
+            try:
+                st = os.statvfs(mountpoint)
+            except OSError:
+                continue
+            if st.f_blocks == 0:
+                continue
+            seen.add(mountpoint)
+
+            size = st.f_blocks*st.f_frsize
+            avail = st.f_bavail*st.f_frsize
+            used = (st.f_blocks - st.f_bfree)*st.f_frsize
+            percent = 100.*used/(used + avail) if used + avail > 0 else 0.
+            lines.append((device, HumanSize(size), HumanSize(used), HumanSize(avail), "%d%%"%round(percent), mountpoint))
+
+    widths = [max(len(line[i]) for line in lines) for i in range(5)]
+    return "\n".join(" ".join(line[i].ljust(widths[i]) for i in range(5)) + " " + line[5] for line in lines)
+
+#returns the uptime and load averages, like uptime
+def Uptime():
+    with open("/proc/uptime") as f:
+        seconds = int(float(f.read().split()[0]))
+    with open("/proc/loadavg") as f:
+        load = f.read().split()[:3]
+
+    days = seconds//86400
+    hours = (seconds%86400)//3600
+    mins = (seconds%3600)//60
+
+    up = "%d:%02d"%(hours, mins)
+    if days > 0:
+        up = "%d day%s, %s"%(days, "" if days == 1 else "s", up)
+
+    return "%s up %s, load average: %s"%(time.strftime("%H:%M:%S"), up, ", ".join(load))
+
+
+#Collects the status. Returns an ordered dictionary of {title: text}
+def Collect():
+    #start the commands first, so they run while we read /proc
+    processes = collections.OrderedDict()
+    for title, cmd in COMMANDS.items():
+        try:
+            processes[title] = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        except OSError as e:
+            processes[title] = e
+
+    status = collections.OrderedDict()
+    status["Disk Info"] = DiskInfo()
+    status["Uptime"] = Uptime()
+
+    for title, process in processes.items():
+        if isinstance(process, OSError):
+            status[title] = "Unable to run %s: %s"%(COMMANDS[title][0], process)
+        else:
+            out = process.communicate()[0]
+            status[title] = out.decode().rstrip()
+
+    return status
+
+
+#returns the (cached) status, starting the thread that refreshes it if need be
+def GetStatus():
+    global _status, _thread
+    with _lock:
+        if _thread is None:
+            _thread = threading.Thread(target=_Refresh, name="StatusRefresh")
+            _thread.daemon = True
+            _thread.start()
+
+        #the first time, we have to wait for the status to be collected
+        if _status is None:
+            _status = Collect()
+
+        return _status
+
+#the thread that refreshes the status
+def _Refresh():
+    global _status
+    while True:
+        time.sleep(refresh)
+        try:
+            status = Collect()
+        except Exception as e:
+            print("Warning: Unable to collect the status: %s"%e)
+            continue
+        _status = status
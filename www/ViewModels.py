@@ -0,0 +1,51 @@
+import collections
+
+from . import PlotCache
+
+
+#Display-ready versions of the statistics returned by the logger.
+#
+# Each variable's statistics for a period become a StatsView: an immutable namedtuple
+# whose numbers are already formatted for display and whose plot is the url of the plot
+# page. They are built once when the statistics are read from the database, and can then
+# be cached (see DataCache) and shared between requests, with the templates rendering
+# them as they are.
+#
+# Fields that don't apply (e.g. value and timestamp, which are only set for the latest
+# readings) are None. The age of a reading is worked out when the page is rendered, with
+# the 'age' template filter (see website.py), so a cached StatsView doesn't go stale.
+
+StatsView = collections.namedtuple("StatsView", ["variable", "unit", "mean", "median", "maxval", "minval",
+                                                 "stddev", "total", "value", "timestamp", "plot"])
+
+#formats a number for display
+def _Format(x):
+    if x is None:
+        return None
+    return "%4.1f"%x
+
+
+#Converts the statistics for a period from the logger (a list of dicts, or None) into a
+# tuple of StatsViews (or None). period is the period they are for (see PlotCache.ParsePeriod)
+def StatsViews(data, period):
+    if data is None:
+        return None
+
+    views = []
+    for reading in data:
+        views.append(StatsView(
+            variable = reading["variable"],
+            unit = reading["unit"],
+            mean = _Format(reading["mean"]),
+            median = _Format(reading["median"]),
+            maxval = _Format(reading["maxval"]),
+            minval = _Format(reading["minval"]),
+            stddev = _Format(reading["stddev"]),
+            total = _Format(reading["total"]),
+            value = _Format(reading.get("value")),
+            timestamp = reading.get("timestamp"),
+            #point the image at the plot page, which renders it if need be
+            plot = PlotCache.GetPlotURL(reading["variable"], period),
+        ))
+
+    return tuple(views)
@@ -0,0 +1,64 @@
+import asyncio
+import traceback
+import concurrent.futures
+from a2wsgi import WSGIMiddleware
+
+from utils import GetConfig
+from .website import app as wsgi_app
+from . import FromLogs
+
+
+#Serves the website with an ASGI server (e.g. uvicorn) rather than a WSGI one:
+#    uvicorn www.asgi:app --host 0.0.0.0 --port 8000
+#
+# The flask app itself is unchanged. Its requests (and so its blocking database queries)
+# run in a bounded pool of asgi_threads threads, so a burst of slow requests queues up
+# rather than starting more threads than the Pi can handle.
+#
+# While the server is running, a background task refreshes a snapshot of the latest data
+# (and the date of the latest reading and the data version) every latest_refresh seconds
+# (see FromLogs.RefreshLatestData), so the /data page, its validators and its cached
+# month list are served from memory rather than querying the database.
+
+config = GetConfig(key="website")
+
+threads = config.get("asgi_threads", 4)
+refresh = config.get("latest_refresh", 5)
+
+_wsgi = WSGIMiddleware(wsgi_app, workers=threads)
+
+#the refresh gets its own thread so it never waits behind requests
+_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+
+
+#refreshes the latest data snapshot every 'refresh' seconds
+async def _RefreshLatest():
+    loop = asyncio.get_event_loop()
+    while True:
+        try:
+            await loop.run_in_executor(_executor, FromLogs.RefreshLatestData, refresh)
+        except Exception as e:
+            print("Warning: Unable to refresh the latest data: %s"%e)
+            traceback.print_exc()
+        await asyncio.sleep(refresh)
+
+#handles the ASGI lifespan protocol, running _RefreshLatest while the server is up
+async def _Lifespan(receive, send):
+    task = None
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            task = asyncio.ensure_future(_RefreshLatest())
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            if task is not None:
+                task.cancel()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        await _Lifespan(receive, send)
+    else:
+        await _wsgi(scope, receive, send)
@@ -1,17 +1,37 @@
 #!/usr/bin/env python
 import flask
 import os
+import socket
 import datetime
 import numpy as np
 import json
+import mimetypes
+from urllib.parse import quote
 
-from . import Status, FromLogs, Directories, Dates
+from utils import GetConfig
+from . import Status, FromLogs, Directories, Dates, PlotCache, Api, Caching
 
 
 app = flask.Flask(__name__)
+app.register_blueprint(Api.api)
+app.after_request(Caching.SetCacheHeaders)
+app.jinja_env.globals["static_url"] = Caching.StaticURL
 
 homedir = os.path.expanduser("~")
-hostname=Status.command("hostname")
+
+#how files are sent: 'python' (by flask), 'nginx' (X-Accel-Redirect) or 'sendfile' (X-Sendfile)
+file_server = GetConfig(key="website").get("file_server","python")
+#the internal nginx location that serves homedir (for X-Accel-Redirect)
+accel_prefix = GetConfig(key="website").get("accel_prefix","/_files/")
+
+#the number of entries on each page of a directory listing
+files_page_size = GetConfig(key="website").get("files_page_size",200)
+hostname=socket.gethostname()
+
+#template filter giving the (approximate) age of a datetime, e.g. "5 minutes"
+@app.template_filter("age")
+def AgeFilter(timestamp):
+    return Dates.FuzzyTimeFromTimedelta(datetime.datetime.now() - timestamp)
 
 #Welcome page
 @app.route("/")
@@ -19,40 +39,120 @@ def WelcomePage():
     return(flask.render_template("index.html",hostname=hostname))
 
 #Shows the status of the machine
-# (runs some commands and returns their output)
+# (collected in the background, see Status.GetStatus)
 @app.route("/status")
 def StatusPage():
-    data={}
-
-    result = Status.command(["df","-h"])
-    data["Disk Info"]=result
-
-    result=  Status.command("uptime")
-    data["Uptime"]=result
-
-    result=Status.command("ifconfig")
-    data["Network"] = result
+    data = Status.GetStatus()
 
     return flask.render_template("status.html",data=data,hostname=hostname)
 
 
 
 #Filesystem browser. Browses all files in $HOME
+# Directory listings are split into pages of files_page_size entries, and can be sorted
+# with ?sort=name|mtime|size&order=asc|desc
 @app.route("/files/")
 @app.route("/files/<path:file>")
 def FileServerPages(file=""):
-    path=os.path.join(homedir,file)
+    path=ResolvePath(file)
+    if path is None:
+        flask.abort(404)
     parent=os.path.join("/files",os.path.dirname(file))
 
     #If it's a directory we display its contents
     if os.path.isdir(path):
+        sort = flask.request.args.get("sort","name")
+        order = flask.request.args.get("order","asc")
+        if sort not in Directories.SORT_KEYS or order not in ["asc","desc"]:
+            flask.abort(400)
+        try:
+            page = max(1,int(flask.request.args.get("page",1)))
+            limit = max(1,int(flask.request.args.get("limit",files_page_size)))
+        except ValueError:
+            flask.abort(400)
+
+        url = os.path.join("/files",file)
         parents = Directories.get_parent_dirs(file)
-        content=Directories.list_directory(path,os.path.join("/files",file))
-        return flask.render_template("directory.html",content=content, dir=path,parents=parents,hostname=hostname)
+        content, total = Directories.list_directory(path,url,sort=sort,reverse=(order=="desc"),offset=(page-1)*limit,limit=limit)
+
+        pages = max(1,(total+limit-1)//limit)
+        def PageURL(page, sort=sort, order=order):
+            return "%s?page=%d&limit=%d&sort=%s&order=%s"%(url,page,limit,sort,order)
+        pager = {
+            "page": page,
+            "pages": pages,
+            "total": total,
+            "prev": PageURL(page-1) if page > 1 else None,
+            "next": PageURL(page+1) if page < pages else None,
+            #clicking the current sort key reverses the order
+            "sorts": [{"name": key, "active": key == sort,
+                       "url": PageURL(1, key, "desc" if key == sort and order == "asc" else "asc")} for key in Directories.SORT_KEYS],
+        }
+
+        #stream the page, so the browser can start rendering a long listing straight away
+        return flask.Response(flask.stream_with_context(StreamTemplate("directory.html",content=content, dir=path,parents=parents,pager=pager,hostname=hostname)))
 
     #otherwise we send the file
     else:
-        return flask.send_file(path)
+        return SendFile(file)
+
+#Returns the real path of 'file' (relative to homedir), with any symlinks and '..'s
+# resolved, or None if that is outside homedir
+def ResolvePath(file):
+    home=os.path.realpath(homedir)
+    path=os.path.realpath(os.path.join(home,file))
+    if os.path.commonpath([home,path]) != home:
+        return None
+    return path
+
+#Sends the file 'file' (relative to homedir).
+# If file_server is 'nginx' or 'sendfile' in the config, we just tell the web server in
+# front of us (with X-Accel-Redirect or X-Sendfile) to send the file itself, so large
+# downloads don't tie up a python worker (see scripts/gunicorn.nginx). Otherwise flask
+# sends it, supporting conditional and range requests.
+def SendFile(file):
+    path=ResolvePath(file)
+    if path is None or not os.path.isfile(path):
+        flask.abort(404)
+
+    if file_server == "python":
+        return flask.send_file(path,conditional=True)
+
+    mimetype = mimetypes.guess_type(path)[0] or "application/octet-stream"
+    response = flask.Response(mimetype=mimetype)
+    if file_server == "nginx":
+        response.headers["X-Accel-Redirect"] = accel_prefix + quote(os.path.relpath(path,os.path.realpath(homedir)))
+    else:
+        response.headers["X-Sendfile"] = path
+    return response
+
+#renders a template a piece at a time, for streaming
+def StreamTemplate(template_name, **context):
+    app.update_template_context(context)
+    template = app.jinja_env.get_template(template_name)
+    stream = template.stream(context)
+    stream.enable_buffering(50)
+    return stream
+
+
+
+#Serves the plot of a variable for a period (see PlotCache.ParsePeriod),
+# rendering it if it is not already in the plot cache
+@app.route("/plot/<variable>/<period>")
+def PlotPage(variable,period):
+    try:
+        path, key = PlotCache.GetPlot(variable,period)
+    except ValueError:
+        flask.abort(404)
+
+    if path is None:
+        flask.abort(404)
+
+    #the plot's key is a hash of its data, so it changes (and the browser's copy is
+    # re-sent) only when the plot does. Last-Modified is when the file was rendered
+    response = flask.send_file(path,mimetype="image/png",conditional=False,etag=False)
+    response.set_etag(key)
+    return response.make_conditional(flask.request,accept_ranges=True)
 
 
 
@@ -61,6 +161,11 @@ def FileServerPages(file=""):
 @app.route("/data/")
 def LatestDataPage():
 
+    #the browser's copy is current unless there has been a new reading since
+    notmodified = Caching.NotModified(*Caching.DataPageValidators())
+    if notmodified is not None:
+        return notmodified
+
     #get the list of months which we put in the LHS of the page as quick links
     months = FromLogs.GetAllMonths()
     
@@ -75,15 +180,22 @@ def LatestDataPage():
     day = today.day
     PrevNext=Dates.PrevNextDay(year, month,day)
 
-    response=flask.make_response(flask.render_template("data.html",hostname=hostname,data=data, months=months,DataTitle="Latest",PrevNext=PrevNext))
-
-    return request_no_caching(response)
+    return flask.render_template("data.html",hostname=hostname,data=data, months=months,DataTitle="Latest",PrevNext=PrevNext)
 
 
 # Shows summary for a particular year
 @app.route("/data/<int:year>")
 def DataForYearPage(year):
 
+    #the page needs the start of the next year too
+    if year<datetime.MINYEAR or year>=datetime.MAXYEAR:
+        months=FromLogs.GetAllMonths()
+        return flask.render_template("data.html",months=months,hostname=hostname,DataTitle="Invalid Year",PrevNext=None), 400
+
+    notmodified = Caching.NotModified(*Caching.DataPageValidators(datetime.datetime(year,1,1),datetime.datetime(year+1,1,1)))
+    if notmodified is not None:
+        return notmodified
+
     data = FromLogs.GetDataForYear(year)
 
     months=FromLogs.GetAllMonths()
@@ -102,8 +214,16 @@ def DataForMonthPage(year,month):
 
     months=FromLogs.GetAllMonths()
 
+    if year<datetime.MINYEAR or year>=datetime.MAXYEAR:
+        return flask.render_template("data.html",months=months,hostname=hostname,DataTitle="Invalid Year",PrevNext=None), 400
+
     if month<1 or month>12:
         return flask.render_template("data.html",months=months,hostname=hostname,DataTitle="Invalid Month",PrevNext=None), 400
+
+    start = datetime.datetime(year,month,1)
+    notmodified = Caching.NotModified(*Caching.DataPageValidators(start,Dates.FirstOfNextMonth(year,month)))
+    if notmodified is not None:
+        return notmodified
        
     data = FromLogs.GetDataForMonth(year,month)
 
@@ -122,9 +242,11 @@ def DataForDayPage(year,month,day):
 
     months=FromLogs.GetAllMonths()
 
-    #Check to see if the date is valid.
+    #Check to see if the date is valid (the page needs the next day too, so not in MAXYEAR).
     try:
         datetime.date(year=year,month=month,day=day)
+        if year>=datetime.MAXYEAR:
+            raise ValueError("Year out of range")
     except ValueError:
         return flask.render_template("data.html",months=months,hostname=hostname,DataTitle="Invalid Date",PrevNext=None), 400
         
@@ -132,6 +254,11 @@ def DataForDayPage(year,month,day):
     if datetime.date.today() == datetime.date(year=year,month=month,day=day):
         return flask.redirect("/data")
 
+    start = datetime.datetime(year,month,day)
+    notmodified = Caching.NotModified(*Caching.DataPageValidators(start,start+datetime.timedelta(days=1)))
+    if notmodified is not None:
+        return notmodified
+
     data = FromLogs.GetDataForDay(year,month,day)
 
     PrevNext=Dates.PrevNextDay(year, month,day)
@@ -164,14 +291,5 @@ def db_stats():
     return flask.render_template("database.html",file=file, variables=variables,hostname=hostname)
 
 
-#Request not to cache anything (else the images tend not to be reloaded by the browser)
-@app.after_request
-def request_no_caching(response):
-    response.headers["Cache-Control"]='no-cache, no-store, must-revalidate'
-    response.headers["pragma"]='no-cache'
-    response.headers["expires"]="0"
-    return response
-
-
 if __name__ == "__main__":
     app.run(host="0.0.0.0",port=5000)